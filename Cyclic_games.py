@@ -34,6 +34,18 @@ win-lose interactions is the reverse fraction of given sparcity value, win-lose
 pseudorandomly. If sparcity in the interaction map is desired so that some species do not interact with
 eachother, sparcity should be added prior to using this function.
 
+random_competition_system: Function for defining competition interactions. A fraction sparcity of the
+species pairs is left out, for the rest the interaction of the first species of the pair is the negative
+absolute value of the original interaction and the interaction of the second is drawn from a normal
+distribution centered on it.
+
+Seeding of the pairwise systems: the species pairs (i, j), i < j, are taken in the row-major order of
+np.triu_indices(n, 1). All bernoulli draws (sparcity, win-lose) are made at once after seeding with their
+own seed and pair k uses draw number (n*(n-1)/2)-1-k, the win-lose draws are used in the same way but
+counted over the pairs that are not left out. The normal draws are made in one call after seeding with
+seed_interaction, one for each pair that is not left out, in pair order. This is the order of the earlier
+loop implementations, so the same seeds give the same interactions.
+
 """                                       
 
 def generalized_rps(pairwise_interactions, groups_total, distance, grouping_function, seed_groups,seed_sparcity, sparcity, seed_interactions, interaction_std, off_target_interactions=False):
@@ -94,48 +106,38 @@ def random_groups_for_rps(species, groups, seed_groups):
 def random_win_lose_system(n, pairwise_interactions, seed_winlose, sparcity, seed_sparcity, interaction_std, seed_interaction, off_target_interactions=False):
     np.random.seed(seed_winlose)
     draw = bernoulli(0.5)
-    winlose = list(map(bool, draw.rvs(int(((n*n)-n)/2))))
+    winlose = np.array(draw.rvs(int(((n*n)-n)/2)), dtype=bool)[::-1]
     
     np.random.seed(seed_sparcity)
     draw = bernoulli(sparcity)
-    skip_list = list(map(bool, draw.rvs(int(((n*n)-n)/2))))
+    skip = np.array(draw.rvs(int(((n*n)-n)/2)), dtype=bool)[::-1]
     
     np.random.seed(seed_interaction)
     new_interactions = np.zeros_like(pairwise_interactions)
     if off_target_interactions:
         new_interactions[:] = pairwise_interactions
     
-    for i in range(n):
-        for j in range(i+1, n):
-            skip = skip_list.pop()
-            if skip:
-                continue
-            win = winlose.pop()
-            interaction_ij = abs(pairwise_interactions[i][j])
-            interaction_ji = np.random.normal(loc=interaction_ij, scale=interaction_ij*interaction_std)
-            if win:
-                new_interactions[i][j] = interaction_ij
-                new_interactions[j][i] = -interaction_ji
-            else:
-                new_interactions[i][j] = -interaction_ij
-                new_interactions[j][i] = interaction_ji
+    i, j = np.triu_indices(n, 1)
+    i, j = i[~skip], j[~skip]
+    win = winlose[:len(i)]
+    interaction_ij = np.abs(pairwise_interactions[i, j])
+    interaction_ji = np.random.normal(loc=interaction_ij, scale=interaction_ij*interaction_std)
+    new_interactions[i, j] = np.where(win, interaction_ij, -interaction_ij)
+    new_interactions[j, i] = np.where(win, -interaction_ji, interaction_ji)
     return new_interactions
 
 def random_competition_system(n, pairwise_interactions, sparcity, seed_sparcity, interaction_std, seed_interaction, off_target_interactions=False):
     np.random.seed(seed_sparcity)
     draw = bernoulli(sparcity)
-    skip_list = list(map(bool, draw.rvs(int(((n*n)-n)/2))))
+    skip = np.array(draw.rvs(int(((n*n)-n)/2)), dtype=bool)[::-1]
     
     np.random.seed(seed_interaction)
     new_interactions = np.zeros_like(pairwise_interactions)
     if off_target_interactions:
         new_interactions[:] = pairwise_interactions
     
-    for i in range(n):
-        for j in range(i+1, n):
-            skip = skip_list.pop()
-            if skip:
-                continue
-            new_interactions[i][j] = -abs(pairwise_interactions[i][j])
-            new_interactions[j][i] = -abs(np.random.normal(loc=new_interactions[i][j], scale=abs(new_interactions[i][j]*interaction_std)))
-    return new_interactions
\ No newline at end of file
+    i, j = np.triu_indices(n, 1)
+    i, j = i[~skip], j[~skip]
+    new_interactions[i, j] = -np.abs(pairwise_interactions[i, j])
+    new_interactions[j, i] = -np.abs(np.random.normal(loc=new_interactions[i, j], scale=np.abs(new_interactions[i, j]*interaction_std)))
+    return new_interactions
@@ -1,39 +1,324 @@
 import numpy as np
-from scipy.linalg import solve as slv
+import warnings
+from itertools import combinations, islice
+from math import comb
+from scipy.linalg import solve as slv, lu_factor, lu_solve, get_lapack_funcs, LinAlgWarning
+from numpy.lib.format import open_memmap
+from scipy.sparse import issparse, csr_matrix
+from scipy.sparse.linalg import gmres, LinearOperator
 from scipy.stats import bernoulli
 
 """steady_state_glv: Function finds a single steady state for a generalized Lotka-Volterra
 model with only pairwise interactions when model parameters are given as an input
 loo_steady_state_glv: Function finds single steady states for all leave-one-out cultures
 for a generalized Lotka-Volterra model with only pairwise interactions when model parameters
-are given
+are given. The full interactions matrix is factorized once and, with B its inverse and x the
+full steady state, the steady state without species i is x_j - x_i*B_ji/B_ii (the Schur
+complement of the removed row and column), so all n cultures take O(n^3) in total. Species
+whose reduced matrix is (nearly) singular, |B_ii| <= loo_rtol*max|B_:i|, or all species if the
+full matrix is ill-conditioned (LAPACK gecon estimate of its reciprocal condition number at most
+loo_rtol), are solved separately with loo_steady_state_species. Cultures whose reduced matrix is
+singular too have NaN abundances (0 for the left out species)
+loo_steady_state_species: Steady state of the culture without species i, by solving the
+reduced system
+leave_k_out_species: Steady state of the culture without the given species, by solving the
+reduced system
+unsolved_culture: Calls loo_steady_state_species or leave_k_out_species and returns NaN abundances
+(0 for the left out species) if the reduced matrix is singular or numerically singular
+lko_steady_state_glv: Generator of the steady states of all cultures with k species left out,
+in chunks of chunk_size cultures: yields the (chunk, k) left out species and the (chunk, n)
+abundances (0 for the left out species). The full matrix is factorized once and each reduced
+steady state follows from the Sherman-Morrison-Woodbury formula, x - B_:K (B_KK)^-1 x_K with B
+the inverse, x the full steady state and K the left out species, solved for a whole chunk with
+batched k by k solves. Cultures where the condition number of B_KK is above 1/loo_rtol, or all
+cultures if the full matrix is ill-conditioned (as in loo_steady_state_glv), are solved with
+leave_k_out_species, and cultures whose reduced matrix is singular too have NaN abundances
+save_lko_steady_state_glv: Streams lko_steady_state_glv to the .npy files
+filename_combinations.npy and filename_abundances.npy (written chunk by chunk as memory
+mapped arrays, so all combinations are never held in memory) and returns the number of cultures
 
 Inputs:
 n = number of species
 ri = intrinsic rate of growth for each species, a numpy vector
-ineractions_matrix = matrix of pairwise interactions in the system
+ineractions_matrix = matrix of pairwise interactions in the system, either a numpy array
+or a scipy.sparse matrix (for example CSR) for large sparse communities
+
+interactions_solver: Returns a function solving matrix x = rhs for one or more right-hand sides
+(vector or (n, k) matrix). Dense matrices are LU factorized. Sparse matrices are never factorized:
+sparse LU of random interaction networks fills in almost completely already at a few percent
+connectance, and a dense factorization of a community of thousands of species takes hundreds of
+megabytes. They are solved with GMRES preconditioned with the diagonal (the self-interactions),
+which only needs matrix-vector products, and only right-hand sides where GMRES doesn't converge
+within maxiter restarts are solved with a dense LU factorization made on first need.
+
+solve_interactions: Solves interactions_matrix x = rhs with interactions_solver, so large
+sparse matrices are only converted to dense if the iterative solver fails.
 
 check_steady_state_viable: Checks that given parameters have nonnegative abundances on gLV
 steady state solver
+
+lemke: Solves the linear complementarity problem w = q + Mz, w >= 0, z >= 0, w*z = 0 with
+Lemke's complementary pivoting algorithm (covering vector of ones). Returns z, or None if the
+algorithm ends on a ray or needs more than max_pivots pivots.
+
+saturated_steady_state_glv: Finds the saturated steady state of the community without any time
+integration: abundances N >= 0 such that every surviving species has zero growth
+(ri + AN = 0) and every absent species has nonpositive growth (ri + AN <= 0), which is the
+linear complementarity problem with M = -A and q = -ri. Returns the abundances of all n
+species, or -1 if Lemke's algorithm fails. For matrices with a negative definite symmetric part
+(for example dominant negative self-interactions) the solution is unique and it is the state
+the community is attracted to.
+
+check_saturated_steady_state_stable: Checks a saturated steady state: the community matrix
+diag(N*)A of the surviving species has only eigenvalues with negative real parts and no absent
+species can invade (ri + AN < -tolerance).
+
+SteadyStateSolver: Steady state solver for a fixed interactions matrix that keeps its LU
+factorization (interactions_solver for sparse matrices), for sweeps over growth rates and repeated viability
+checks of the same community.
+    solve: Steady states for ri given as a vector, or as an (n, k) matrix with one growth rate
+    vector per column, which are all solved with one multi column lu_solve.
+    viable: Boolean per column of ri, True if all abundances of that steady state are positive
+    (as check_steady_state_viable).
+    update_diagonal: Changes the self-interactions (the diagonal) to the given values. If at most
+    max_update_rank entries differ from the factorized matrix the factorization is kept and the
+    solves are corrected with the Sherman-Morrison-Woodbury formula for the rank-k change,
+    otherwise the new matrix is factorized.
 """
 
+def interactions_solver(interactions_matrix, rtol=1e-12, restart=50, maxiter=20):
+    n = interactions_matrix.shape[0]
+    if not issparse(interactions_matrix):
+        factorization = lu_factor(interactions_matrix)
+        return lambda rhs: lu_solve(factorization, rhs)
+    interactions_matrix = csr_matrix(interactions_matrix, dtype=float)
+    diagonal = interactions_matrix.diagonal()
+    preconditioner = None
+    if np.all(diagonal != 0):
+        preconditioner = LinearOperator((n, n), matvec=lambda v: v/diagonal, dtype=float)
+    dense = []
+    def solve_vector(rhs):
+        with np.errstate(all='ignore'):
+            solution, info = gmres(interactions_matrix, rhs, M=preconditioner, rtol=rtol, atol=0, restart=restart, maxiter=maxiter)
+        if info == 0 and np.all(np.isfinite(solution)):
+            return solution
+        if len(dense) == 0:
+            dense.append(lu_factor(interactions_matrix.toarray()))
+        return lu_solve(dense[0], rhs)
+    def solve(rhs):
+        rhs = np.asarray(rhs, dtype=float)
+        if rhs.ndim == 1:
+            return solve_vector(rhs)
+        return np.column_stack([solve_vector(column) for column in np.transpose(rhs)])
+    return solve
+
+def solve_interactions(interactions_matrix, rhs):
+    if issparse(interactions_matrix):
+        return interactions_solver(interactions_matrix)(rhs)
+    return slv(interactions_matrix, rhs)
+
 def steady_state_glv(n, ri, interactions_matrix):
-    abundance_n_member_community = slv(interactions_matrix, -ri*np.ones(n))
+    abundance_n_member_community = solve_interactions(interactions_matrix, -ri*np.ones(n))
     return abundance_n_member_community
 
-def loo_steady_state_glv(n, ri, interactions_matrix):
-    loo_abundances = np.zeros((n,n))
-    for i in range(0, n):
-        temp_interactions = np.delete(interactions_matrix, i, 0)
-        temp_interactions = np.delete(temp_interactions, i, 1)
-        abund = slv(temp_interactions, -ri*np.ones((n-1,1)))
-        abund = np.insert(abund, i, 0)
-        loo_abundances[i] = abund
-    
+def loo_steady_state_species(n, ri, interactions_matrix, i):
+    keep = np.delete(np.arange(n), i)
+    temp_interactions = interactions_matrix[keep][:, keep]
+    abund = solve_interactions(temp_interactions, -ri[keep]*np.ones(n-1))
+    return np.insert(abund, i, 0)
+
+def inverse_interactions(interactions_matrix, loo_rtol=1e-10):
+    n = interactions_matrix.shape[0]
+    # The inverse is dense anyway, so sparse matrices are factorized as dense
+    if issparse(interactions_matrix):
+        interactions_matrix = interactions_matrix.toarray()
+    with np.errstate(all='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', LinAlgWarning)
+        lu, piv = lu_factor(interactions_matrix, check_finite=False)
+        gecon, = get_lapack_funcs(('gecon',), (lu,))
+        rcond, info = gecon(lu, np.linalg.norm(interactions_matrix, 1))
+        if info != 0 or not rcond > loo_rtol:
+            return None
+        inverse = lu_solve((lu, piv), np.eye(n), check_finite=False)
+    if not np.all(np.isfinite(inverse)):
+        return None
+    return inverse
+
+def unsolved_culture(n, solve, *args):
+    # Cultures whose reduced matrix is singular (or numerically singular) have no unique steady state
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', LinAlgWarning)
+            return solve(n, *args)
+    except (np.linalg.LinAlgError, LinAlgWarning):
+        abundances = np.full(n, np.nan)
+        abundances[args[-1]] = 0
+        return abundances
+
+def loo_steady_state_glv(n, ri, interactions_matrix, loo_rtol=1e-10):
+    ri = ri*np.ones(n)
+    inverse = inverse_interactions(interactions_matrix, loo_rtol)
+    if inverse is None:
+        return np.array([unsolved_culture(n, loo_steady_state_species, ri, interactions_matrix, i) for i in range(n)])
+    abundances = inverse@(-ri)
+    pivots = np.diag(inverse)
+    safe = np.abs(pivots) > loo_rtol*np.max(np.abs(inverse), axis=0)
+    weights = np.zeros(n)
+    weights[safe] = abundances[safe]/pivots[safe]
+    loo_abundances = abundances[None, :]-weights[:, None]*np.transpose(inverse)
+    np.fill_diagonal(loo_abundances, 0)
+    for i in np.flatnonzero(~safe):
+        loo_abundances[i] = unsolved_culture(n, loo_steady_state_species, ri, interactions_matrix, i)
     return loo_abundances
 
+def leave_k_out_species(n, ri, interactions_matrix, removed):
+    keep = np.delete(np.arange(n), removed)
+    temp_interactions = interactions_matrix[keep][:, keep]
+    abund = np.zeros(n)
+    abund[keep] = solve_interactions(temp_interactions, -ri[keep]*np.ones(len(keep)))
+    return abund
+
+def lko_steady_state_glv(n, ri, interactions_matrix, k, chunk_size=10000, loo_rtol=1e-10):
+    ri = ri*np.ones(n)
+    inverse = inverse_interactions(interactions_matrix, loo_rtol)
+    if inverse is not None:
+        abundances = inverse@(-ri)
+    removals = combinations(range(n), k)
+    while True:
+        removed = np.array(list(islice(removals, chunk_size)), dtype=int).reshape(-1, k)
+        if len(removed) == 0:
+            return
+        if inverse is None:
+            yield removed, np.array([unsolved_culture(n, leave_k_out_species, ri, interactions_matrix, r) for r in removed])
+            continue
+        pivots = inverse[removed[:, :, None], removed[:, None, :]]
+        safe = np.linalg.cond(pivots) < 1/loo_rtol
+        weights = np.zeros((len(removed), k))
+        weights[safe] = np.linalg.solve(pivots[safe], abundances[removed[safe]][:, :, None])[:, :, 0]
+        lko_abundances = abundances[None, :]-np.einsum('ick,ck->ci', inverse[:, removed], weights)
+        np.put_along_axis(lko_abundances, removed, 0, axis=1)
+        for c in np.flatnonzero(~safe):
+            lko_abundances[c] = unsolved_culture(n, leave_k_out_species, ri, interactions_matrix, removed[c])
+        yield removed, lko_abundances
+
+def save_lko_steady_state_glv(filename, n, ri, interactions_matrix, k, chunk_size=10000, loo_rtol=1e-10):
+    cultures = comb(n, k)
+    saved_combinations = open_memmap(f"{filename}_combinations.npy", mode='w+', dtype=int, shape=(cultures, k))
+    saved_abundances = open_memmap(f"{filename}_abundances.npy", mode='w+', dtype=float, shape=(cultures, n))
+    row = 0
+    for removed, lko_abundances in lko_steady_state_glv(n, ri, interactions_matrix, k, chunk_size, loo_rtol):
+        saved_combinations[row:row+len(removed)] = removed
+        saved_abundances[row:row+len(removed)] = lko_abundances
+        row += len(removed)
+    saved_combinations.flush()
+    saved_abundances.flush()
+    return cultures
+
 def check_steady_state_viable(n, ri, interactions_matrix):
     abundances = steady_state_glv(n, ri, interactions_matrix)
     if sum(abundances<=0) == 0:
         return True
-    return False
\ No newline at end of file
+    return False
+
+def lemke(M, q, max_pivots=None, tolerance=1e-12):
+    n = len(q)
+    if np.all(q >= 0):
+        return np.zeros(n)
+    if max_pivots is None:
+        max_pivots = 50*n
+    tableau = np.hstack((np.eye(n), -M, -np.ones((n, 1)), q[:, None]))
+    basis = np.arange(n)
+    artificial = 2*n
+    row = np.argmin(q)
+    entering = artificial
+    for pivots in range(max_pivots):
+        tableau[row] = tableau[row]/tableau[row, entering]
+        others = np.arange(n) != row
+        tableau[others] -= np.outer(tableau[others, entering], tableau[row])
+        leaving = basis[row]
+        basis[row] = entering
+        if leaving == artificial:
+            solution = np.zeros(2*n+1)
+            solution[basis] = tableau[:, -1]
+            return np.maximum(solution[n:2*n], 0)
+        entering = leaving+n if leaving < n else leaving-n
+        column = tableau[:, entering]
+        positive = column > tolerance
+        if not np.any(positive):
+            return None
+        ratios = np.full(n, np.inf)
+        ratios[positive] = tableau[positive, -1]/column[positive]
+        ties = np.flatnonzero(ratios <= np.min(ratios)+tolerance)
+        row = ties[0]
+        if np.any(basis[ties] == artificial):
+            row = ties[np.flatnonzero(basis[ties] == artificial)[0]]
+    return None
+
+def saturated_steady_state_glv(n, ri, interactions_matrix, max_pivots=None):
+    if issparse(interactions_matrix):
+        interactions_matrix = interactions_matrix.toarray()
+    with np.errstate(all='ignore'):
+        abundances = lemke(-np.asarray(interactions_matrix, dtype=float), -np.asarray(ri, dtype=float)*np.ones(n), max_pivots)
+    if abundances is None or not np.all(np.isfinite(abundances)):
+        return -1
+    return abundances
+
+def check_saturated_steady_state_stable(n, ri, interactions_matrix, abundances, tolerance=1e-9):
+    if issparse(interactions_matrix):
+        interactions_matrix = interactions_matrix.toarray()
+    growth = ri+interactions_matrix@abundances
+    survivors = abundances > tolerance
+    if np.any(growth[~survivors] >= -tolerance):
+        return False
+    community_matrix = abundances[survivors][:, None]*interactions_matrix[survivors][:, survivors]
+    return bool(np.all(np.real(np.linalg.eigvals(community_matrix)) < 0))
+
+class SteadyStateSolver:
+    def __init__(self, interactions_matrix, max_update_rank=None):
+        self.n = interactions_matrix.shape[0]
+        self.max_update_rank = self.n//3 if max_update_rank is None else max_update_rank
+        self.factorize(interactions_matrix)
+
+    def factorize(self, interactions_matrix):
+        if issparse(interactions_matrix):
+            self.interactions_matrix = csr_matrix(interactions_matrix, dtype=float)
+            self.base_solve = interactions_solver(self.interactions_matrix)
+        else:
+            self.interactions_matrix = np.array(interactions_matrix, dtype=float)
+            factorization = lu_factor(self.interactions_matrix)
+            self.base_solve = lambda rhs: lu_solve(factorization, rhs)
+        self.base_diagonal = self.interactions_matrix.diagonal().copy()
+        self.changed = np.zeros(0, dtype=int)
+
+    def update_diagonal(self, diagonal):
+        delta = np.asarray(diagonal, dtype=float)*np.ones(self.n)-self.base_diagonal
+        changed = np.flatnonzero(delta)
+        if len(changed) > self.max_update_rank:
+            interactions_matrix = self.interactions_matrix.copy()
+            if issparse(interactions_matrix):
+                interactions_matrix = interactions_matrix.tolil()
+                interactions_matrix.setdiag(diagonal)
+            else:
+                interactions_matrix[np.arange(self.n), np.arange(self.n)] = diagonal
+            self.factorize(interactions_matrix)
+            return
+        self.changed = changed
+        self.delta = delta[changed]
+        if len(changed) == 0:
+            return
+        columns = np.zeros((self.n, len(changed)))
+        columns[changed, np.arange(len(changed))] = 1
+        self.update_columns = self.base_solve(columns)
+        capacitance = np.eye(len(changed))+self.delta[:, None]*self.update_columns[changed]
+        self.capacitance = lu_factor(capacitance)
+
+    def solve(self, ri):
+        rhs = -np.asarray(ri, dtype=float)
+        abundances = self.base_solve(rhs)
+        if len(self.changed) > 0:
+            correction = lu_solve(self.capacitance, (self.delta*abundances[self.changed].T).T)
+            abundances = abundances-self.update_columns@correction
+        return abundances
+
+    def viable(self, ri):
+        return np.all(self.solve(ri) > 0, axis=0)
@@ -4,7 +4,8 @@ import numpy as np
 import pandas as pd
 from parameters import generate_growth_rates, generate_interactions, generate_abundances, adjust_selfinteractions_for_carrying_capacity, add_sparcity
 from Cyclic_games import generalized_rps, even_groups_for_rps
-from simulations_simple_gLV import simple_gLV_with_extinction, simple_gLV_return_steady_state_abundances
+from simulations_simple_gLV import simple_gLV_with_extinction
+from sim_gLV_RK import lcp_gLV_return_steady_state
 from graphics import abundances_line_chart
 from data_modification import relative_abundances
 
@@ -59,7 +60,7 @@ def simulated_datasets_abundances(repetition=20,n=23,maxtime=250,time_increment=
                 abundances_mean=np.random.randint(abundances_mean_range_low,abundances_mean_range_up)
                 abundance_means.append(abundances_mean)
                 starting_abundances = generate_abundances(n,abundances_seed,abundances_mean,abundances_std)
-                abundances = simple_gLV_return_steady_state_abundances(n, maxtime, time_increment, pairwise_interactions, ri, starting_abundances)
+                abundances = lcp_gLV_return_steady_state(n, maxtime, time_increment, pairwise_interactions, ri, starting_abundances)
                 
                 
                 if type(abundances) == int:
@@ -143,7 +144,7 @@ def simulated_datasets_ri(repetition=20,n=23,maxtime=250,time_increment=0.05,ri_
                 interact_frame = pd.DataFrame(interact_array, columns=interact_columns)
                 interactions.append(interact_frame)
                 starting_abundances = generate_abundances(n,abundances_seed,abundances_mean,abundances_std)
-                abundances = simple_gLV_return_steady_state_abundances(n, maxtime, time_increment, pairwise_interactions, ri, starting_abundances)
+                abundances = lcp_gLV_return_steady_state(n, maxtime, time_increment, pairwise_interactions, ri, starting_abundances)
     
                 
                 if type(abundances) == int:
@@ -240,7 +241,7 @@ def simulated_datasets_ri_abundances(repetition=20,n=23,maxtime=250,time_increme
                 interact_frame = pd.DataFrame(interact_array, columns=interact_columns)
                 interactions.append(interact_frame)
                 starting_abundances = generate_abundances(n,abundances_seed,abundances_mean,abundances_std)
-                abundances = simple_gLV_return_steady_state_abundances(n, maxtime, time_increment, pairwise_interactions, ri, starting_abundances)
+                abundances = lcp_gLV_return_steady_state(n, maxtime, time_increment, pairwise_interactions, ri, starting_abundances)
     
                 
                 if type(abundances) == int:
@@ -0,0 +1,177 @@
+import numpy as np
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from GLV_steady_state_calculator import saturated_steady_state_glv, check_saturated_steady_state_stable, solve_interactions
+from sim_gLV_RK import gLV_RK45, negative_definite_interactions
+
+''' Assembly graph of a generalized Lotka-Volterra community: which subcommunities are feasible,
+stable and uninvadable, and how the community moves between them when species invade (or are
+removed). Meant for communities of up to about 25-30 species, subcommunities are kept as bit
+masks (bit i set if species i is present).
+
+Starting from the start community (by default the empty one) the graph is explored breadth first.
+For each community on the frontier the invasion growth rate of every absent species,
+ri + sum_j A_ij N*_j (ri minus the r_mutant of invasion.r_mutant_calculator with the mutant at
+zero abundance), is calculated from the equilibrium, and only species with a growth rate above
+tolerance are tried, the rest can't invade and are pruned. When the symmetric part of the
+interactions of the community plus the invader is negative definite its saturated steady state is
+unique and globally stable, so it is the state the invasion leads to, and it is found without time
+integration as a linear complementarity problem (GLV_steady_state_calculator.saturated_steady_state_glv).
+Its survivors are the community the graph moves to. These outcomes are memoized by the community
+plus invader, so each subset is solved only once. Otherwise the subset can have several stable
+states and the one reached depends on where the community starts from, so the outcome is simulated
+with the adaptive sim_gLV_RK.gLV_RK45 up to maxtime from the equilibrium of the community with the invader
+at invasion_abundance (or without the removed species), and memoized by the community and the
+move. The simulated state is only accepted if the interior steady state of the species above
+closeness times the largest abundance is feasible, stable and uninvadable within the subset and
+the simulation ended within closeness times the largest abundance of it. The outcomes of a whole
+frontier are found over a process pool (workers=1 runs in the calling process). Outcomes that
+can't be resolved (for example oscillating or heteroclinic dynamics) give an edge to None.
+
+mask_species: Returns the indices of the species in a bit mask.
+
+subset_outcome: Saturated steady state of the species in the mask. Returns the bit mask of the
+survivors and the abundances of all n species, or None if the steady state isn't found or isn't
+stable and uninvadable within the subset.
+
+certified_outcome: Accepts a simulated state of the species in the mask as described above.
+Returns the bit mask of the survivors and their steady state abundances (of all n species), or None.
+
+simulated_outcome: Simulates the species in the mask from the given starting abundances and
+returns the certified_outcome of the end state.
+
+move_outcome: subset_outcome for a bit mask, simulated_outcome for a (mask, starting abundances) job.
+
+unique_subset: True if the symmetric part of the interactions of the species in the mask is
+negative definite.
+
+assembly_graph: Explores the assembly graph. The start community has to be at its interior steady
+state, which has to be feasible and stable and which can't be invaded by its own species. With removals=True the removal of each present
+species (and the steady state of the remaining ones) is added as a transition too. Returns the
+graph as a dictionary {community: [(species, "invasion"/"removal", new community or None)]}, the
+equilibria {community: abundances} and the absorbing communities, which are stable and can't be
+invaded by any species.
+'''
+
+def mask_species(mask, n):
+    return np.array([i for i in range(n) if mask >> i & 1], dtype=int)
+
+def subset_outcome(n, ri, interactions, tolerance, mask):
+    species = mask_species(mask, n)
+    abundances = np.zeros(n)
+    if len(species) == 0:
+        return 0, abundances
+    sub_interactions = interactions[species][:, species]
+    saturated = saturated_steady_state_glv(len(species), ri[species], sub_interactions)
+    if type(saturated) == int or not check_saturated_steady_state_stable(len(species), ri[species], sub_interactions, saturated, tolerance):
+        return None
+    survivors = saturated > tolerance
+    abundances[species[survivors]] = saturated[survivors]
+    return int(sum(1 << int(i) for i in species[survivors])), abundances
+
+def certified_outcome(n, ri, interactions, tolerance, closeness, mask, state):
+    species = mask_species(mask, n)
+    present = state[species] > closeness*np.max(state, initial=0)
+    survivors = species[present]
+    abundances = np.zeros(n)
+    if len(survivors) > 0:
+        try:
+            abundances[survivors] = solve_interactions(interactions[survivors][:, survivors], -ri[survivors])
+        except np.linalg.LinAlgError:
+            return None
+    if np.any(abundances[survivors] <= tolerance) or np.max(np.abs(state-abundances), initial=0) > closeness*np.max(abundances, initial=1):
+        return None
+    if not check_saturated_steady_state_stable(len(species), ri[species], interactions[species][:, species], abundances[species], tolerance):
+        return None
+    return int(sum(1 << int(i) for i in survivors)), abundances
+
+def simulated_outcome(n, ri, interactions, tolerance, maxtime, time_increment, closeness, mask, starting_abundances):
+    simulated = gLV_RK45(n, maxtime, time_increment, interactions, ri, starting_abundances, output_times=[maxtime])
+    if type(simulated) == int:
+        return None
+    return certified_outcome(n, ri, interactions, tolerance, closeness, mask, simulated[-1])
+
+def move_outcome(n, ri, interactions, tolerance, maxtime, time_increment, closeness, job):
+    if type(job) == int:
+        return subset_outcome(n, ri, interactions, tolerance, job)
+    return simulated_outcome(n, ri, interactions, tolerance, maxtime, time_increment, closeness, *job)
+
+def unique_subset(interactions, mask, n):
+    species = mask_species(mask, n)
+    return negative_definite_interactions(interactions[species][:, species])
+
+def assembly_graph(n, ri, interactions, start=0, removals=False, tolerance=1e-9, workers=None, chunksize=16, invasion_abundance=1, maxtime=1000, time_increment=0.05, closeness=1e-3):
+    ri = np.asarray(ri, dtype=float)
+    interactions = np.asarray(interactions, dtype=float)
+    outcome = partial(move_outcome, n, ri, interactions, tolerance, maxtime, time_increment, closeness)
+    species = mask_species(start, n)
+    first = None
+    if len(species) == 0 or negative_definite_interactions(interactions[species][:, species]):
+        first = subset_outcome(n, ri, interactions, tolerance, start)
+    else:
+        # The start community has to be at its interior steady state, found without the simulator
+        interior = np.zeros(n)
+        try:
+            interior[species] = solve_interactions(interactions[species][:, species], -ri[species])
+            first = certified_outcome(n, ri, interactions, tolerance, closeness, start, interior)
+        except np.linalg.LinAlgError:
+            pass
+    if first is None or first[0] != start:
+        return -1
+    # With a negative definite symmetric part all subcommunities have a unique saturated steady state
+    all_unique = negative_definite_interactions(interactions)
+    unique = {}
+    outcomes = {start: first}
+    equilibria = {start: first[1]}
+    graph = {}
+    absorbing = []
+    frontier = [start]
+    pool = None if workers == 1 else ProcessPoolExecutor(max_workers=workers)
+    try:
+        while frontier:
+            moves = {}
+            jobs = {}
+            for community in frontier:
+                growth = ri+interactions@equilibria[community]
+                moves[community] = [(i, "invasion", community | 1 << i) for i in range(n) if not community >> i & 1 and growth[i] > tolerance]
+                if len(moves[community]) == 0:
+                    absorbing.append(community)
+                if removals:
+                    moves[community] += [(int(i), "removal", community & ~(1 << int(i))) for i in mask_species(community, n)]
+                for species, kind, subset in moves[community]:
+                    if subset not in unique:
+                        unique[subset] = all_unique or unique_subset(interactions, subset, n)
+                    if unique[subset]:
+                        key = subset
+                        job = subset
+                    else:
+                        # Several stable states are possible, so the outcome depends on where the community starts from
+                        key = (community, species, kind)
+                        starting_abundances = equilibria[community].copy()
+                        starting_abundances[species] = invasion_abundance if kind == "invasion" else 0
+                        job = (subset, starting_abundances)
+                    if key not in outcomes and key not in jobs:
+                        jobs[key] = job
+            keys = list(jobs)
+            if pool is None:
+                results = map(outcome, [jobs[key] for key in keys])
+            else:
+                results = pool.map(outcome, [jobs[key] for key in keys], chunksize=chunksize)
+            outcomes.update(zip(keys, results))
+            frontier = []
+            for community in moves:
+                graph[community] = []
+                for species, kind, subset in moves[community]:
+                    key = subset if unique[subset] else (community, species, kind)
+                    if outcomes[key] is None:
+                        graph[community].append((species, kind, None))
+                        continue
+                    target, abundances = outcomes[key]
+                    graph[community].append((species, kind, target))
+                    if target not in equilibria:
+                        equilibria[target] = abundances
+                        frontier.append(target)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return graph, equilibria, absorbing
@@ -8,12 +8,14 @@ of the given mean. For example if mean is 100 CFU and desired std is 10 CFU the
 
 Once desired community structure is found, copy community seeds and parameters to data generation.
 For easy application the area to copy has been marked with comments "copypaste start" and "copypaste end"
+
+To search many seed pairs at once use community_screening.py, which ranks seed pairs by the given criteria.
 '''
 
 import numpy as np
 import pandas as pd
 from parameters import generate_growth_rates, generate_interactions, generate_abundances, add_sparcity, adjust_selfinteractions_for_carrying_capacity
-from sim_gLV_RK import gLV_RK
+from sim_gLV_RK import gLV_RK, gLV_rosenbrock
 from Cyclic_games import random_win_lose_system, random_competition_system
 from graphics import abundances_line_chart
 
@@ -100,6 +102,10 @@ pairwise_interactions = adjust_selfinteractions_for_carrying_capacity(n, pairwis
 
 abundances = gLV_RK(n, maxtime, time_increment, pairwise_interactions, ri, starting_abundances)
 
+#Explicit Runge-Kutta fails on stiff communities (very different self-interactions), retry with the stiff solver
+if type(abundances) == int:
+    abundances = gLV_rosenbrock(n, maxtime, time_increment, pairwise_interactions, ri, starting_abundances)
+
 if type(abundances) == int:
     print("Community simulation failed, change parameters")
 else:
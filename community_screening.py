@@ -0,0 +1,187 @@
+'''High-throughput version of community_finder.py. Draws many (species_seed, interact_seed) pairs,
+builds their communities with the same parameters and seeding as community_finder.py, and returns
+a table of the seed pairs that meet the given criteria, ranked from best to worst. The settings at
+the bottom of the file are the same as in community_finder.py, so a seed pair from the table can be
+copied to community_finder.py or index_data_gen_loo.py as is. Run with "python community_screening.py".
+
+The criteria are checked on the steady state the community reaches within maxtime or, with
+steady_state=False, on the abundances at maxtime as in community_finder.py. For steady state
+screening the saturated steady state of each community is first solved without any time
+integration (GLV_steady_state_calculator.saturated_steady_state_glv), and communities are rejected
+without simulating them when
+- the saturated steady state can't be found (infeasible) or it isn't stable and uninvadable, so
+the community has no steady state that all of its species settle to from nearby (for communities
+with a unique steady state this is exact, for others it is a screening heuristic), or
+- the symmetric part of the interactions is negative definite, so the saturated steady state is
+unique and globally stable and it is the steady state the community reaches from any starting
+abundances, and it has fewer than min_coexisting species with at least min_abundance.
+The remaining communities are simulated together in batches with sim_gLV_RK.batch_gLV_RK (members
+that fail are retried one by one with the stiff solver gLV_rosenbrock, as in community_finder.py)
+and their endpoint has to be a steady state (status 1) meeting the criteria, so communities that
+don't settle within maxtime, for example oscillating ones, are rejected too. Abundances at maxtime
+can be far from the steady state, so with steady_state=False nothing can be rejected analytically
+and all communities are simulated.
+
+random_seed_pairs: Draws the given number of (species_seed, interact_seed) pairs from seed.
+
+seeded: Seeds the given numpy.random.RandomState and returns it.
+
+build_communities: Growth rates (B, n) and interactions (B, n, n) of all seed pairs, the same
+communities as community_finder.py builds. The random numbers of each seed pair are drawn with one
+reseeded RandomState (the global random state isn't touched) and the competition system and the
+self-interactions of all communities are set together on the stack.
+
+build_community: Growth rates and interactions of one community, as in community_finder.py.
+
+analytic_screen: Number of species with at least min_abundance at the saturated steady state, a
+flag that the steady state is stable and uninvadable and a flag that it is unique (symmetric part
+of the interactions negative definite), for each community.
+
+screen_communities: Runs the screening and returns a pandas DataFrame with the seeds, the number of
+coexisting species and the minimum abundance at maxtime, the predicted number of coexisting
+species at steady state (-1 with steady_state=False, where it isn't solved) and the simulation
+status (1 steady state, 0 maxtime, -1 error) of the communities meeting the criteria, sorted by
+number of coexisting species and minimum abundance.
+'''
+
+import numpy as np
+import pandas as pd
+from parameters import generate_abundances
+from sim_gLV_RK import batch_gLV_RK, gLV_rosenbrock, negative_definite_interactions
+from GLV_steady_state_calculator import saturated_steady_state_glv, check_saturated_steady_state_stable
+
+def random_seed_pairs(pairs, seed=None):
+    return np.random.default_rng(seed).integers(0, 2**31, size=(pairs, 2))
+
+def seeded(draw, seed):
+    draw.seed(seed)
+    return draw
+
+def build_communities(n, seed_pairs, ri_mean, ri_std, cc_mean, cc_std, interact_mean, interact_std, sparcity, sparcity_amount, comp_std, comp_sparcity, off_target_interactions):
+    seed_pairs = np.atleast_2d(seed_pairs)
+    B = len(seed_pairs)
+    i, j = np.triu_indices(n, 1)
+    ri = np.zeros((B, n))
+    carrying_capacities = np.zeros((B, n))
+    interactions = np.zeros((B, n, n))
+    skip = np.zeros((B, len(i)), dtype=bool)
+    magnitudes = np.zeros((B, len(i)))
+    # The random streams are the ones of community_finder.py, drawn from a reseeded RandomState in stead of the global one
+    # (bernoulli draws of scipy.stats are binomial draws with one trial)
+    draw = np.random.RandomState()
+    for b, (species_seed, interact_seed) in enumerate(seed_pairs):
+        ri_seed, cc_seed = seeded(draw, species_seed).randint(0, 2**31, size=2)
+        interactions_seed, interactions_sparcity_seed, competition_interactions_seed, competition_sparcity_seed, competition_magnitude_seed = seeded(draw, interact_seed).randint(0, 2**31, size=5)
+        ri[b] = seeded(draw, ri_seed).normal(loc=ri_mean, scale=abs(ri_mean*ri_std), size=n)
+        carrying_capacities[b] = seeded(draw, cc_seed).normal(loc=cc_mean, scale=cc_mean*cc_std, size=n).astype(int)
+        interactions[b] = seeded(draw, interactions_seed).normal(loc=interact_mean, scale=interact_std, size=(n, n))
+        if sparcity:
+            interactions[b][np.reshape(seeded(draw, interactions_sparcity_seed).binomial(1, sparcity_amount, n*n), (n, n)) == 1] = 0
+        skip[b] = np.array(seeded(draw, competition_sparcity_seed).binomial(1, comp_sparcity, len(i)), dtype=bool)[::-1]
+        magnitudes[b, ~skip[b]] = seeded(draw, competition_magnitude_seed).standard_normal(np.sum(~skip[b]))
+    ri = np.abs(ri)
+    carrying_capacities = np.abs(carrying_capacities)
+    interactions = np.around(interactions, decimals=8)
+    # Competition system of Cyclic_games.random_competition_system for the whole stack
+    winners = -np.abs(interactions[:, i, j])
+    losers = -np.abs(winners+np.abs(winners*comp_std)*magnitudes)
+    competition = interactions.copy() if off_target_interactions else np.zeros_like(interactions)
+    competition[:, i, j] = np.where(skip, competition[:, i, j], winners)
+    competition[:, j, i] = np.where(skip, competition[:, j, i], losers)
+    competition[:, np.arange(n), np.arange(n)] = -ri/carrying_capacities
+    return ri, competition
+
+def build_community(n, species_seed, interact_seed, *community_settings):
+    ri, interactions = build_communities(n, [(species_seed, interact_seed)], *community_settings)
+    return ri[0], interactions[0]
+
+def analytic_screen(n, ri, interactions, min_abundance):
+    predicted = np.zeros(len(ri), dtype=int)
+    stable = np.zeros(len(ri), dtype=bool)
+    unique = np.zeros(len(ri), dtype=bool)
+    for i in range(len(ri)):
+        unique[i] = negative_definite_interactions(interactions[i])
+        saturated = saturated_steady_state_glv(n, ri[i], interactions[i])
+        if type(saturated) == int:
+            continue
+        predicted[i] = np.sum(saturated >= min_abundance)
+        stable[i] = check_saturated_steady_state_stable(n, ri[i], interactions[i], saturated)
+    return predicted, stable, unique
+
+def screen_communities(n, maxtime, time_increment, starting_abundances, seed_pairs, community_settings, min_abundance=10, min_coexisting=None, batch_size=500, steady_state=True):
+    if min_coexisting is None:
+        min_coexisting = n
+    seed_pairs = np.asarray(seed_pairs)
+    ri, interactions = build_communities(n, seed_pairs, *community_settings)
+    if steady_state:
+        predicted, stable, unique = analytic_screen(n, ri, interactions, min_abundance)
+        candidates = np.flatnonzero(stable & (~unique | (predicted >= min_coexisting)))
+    else:
+        predicted = np.full(len(seed_pairs), -1)
+        candidates = np.arange(len(seed_pairs))
+    max_increments = int(maxtime*(1/time_increment))
+    endpoints = np.zeros((len(candidates), n))
+    status = np.zeros(len(candidates), dtype=int)
+    for start in range(0, len(candidates), batch_size):
+        members = candidates[start:start+batch_size]
+        starting = np.tile(starting_abundances, (len(members), 1))
+        abundances, batch_status = batch_gLV_RK(n, maxtime, time_increment, interactions[members], ri[members], starting, [max_increments])
+        endpoints[start:start+len(members)] = abundances[:, -1]
+        status[start:start+len(members)] = batch_status
+    for i in np.flatnonzero(status == -1):
+        abundances = gLV_rosenbrock(n, maxtime, time_increment, interactions[candidates[i]], ri[candidates[i]], starting_abundances)
+        if type(abundances) != int:
+            endpoints[i] = abundances[-1]
+            status[i] = 0
+    coexisting = np.sum(endpoints >= min_abundance, axis=1)
+    surviving = np.where(endpoints >= min_abundance, endpoints, np.inf)
+    table = pd.DataFrame({"species_seed": seed_pairs[candidates, 0], "interact_seed": seed_pairs[candidates, 1], "coexisting": coexisting, "min_abundance": np.min(surviving, axis=1, initial=np.inf), "predicted_coexisting": predicted[candidates], "status": status})
+    if steady_state:
+        table = table[(status == 1) & (coexisting >= min_coexisting)]
+    else:
+        table = table[(status != -1) & (coexisting >= min_coexisting)]
+    return table.sort_values(["coexisting", "min_abundance"], ascending=False, ignore_index=True)
+
+if __name__ == "__main__":
+    #Screening settings
+    #number of seed pairs drawn and the seed they are drawn with
+    pairs = 2000
+    screening_seed = 1
+    #criteria: species count as coexisting if their abundance at maxtime is at least min_abundance,
+    #communities need at least min_coexisting coexisting species (None means all n)
+    min_abundance = 10
+    min_coexisting = None
+    #check the criteria on the steady state (True) or on the abundances at maxtime as in community_finder.py (False),
+    #only steady state screening can reject communities without simulating them
+    steady_state = True
+    #simulation time of the screening, communities that haven't reached steady state by then are rejected
+    screening_maxtime = 500
+    #name of the output file
+    output_name = "screening_output.csv"
+
+    #starting abundances as in community_finder.py
+    sa_seed = 55
+    sa_mean = 100
+    sa_std = 0.1
+
+    #Community settings, see community_finder.py
+    n = 23
+    maxtime = 25
+    time_increment = 0.05
+    ri_mean = 0.6
+    ri_std = 0.2
+    cc_mean = 2000
+    cc_std = 0.2
+    interact_mean = -0.00003
+    interact_std = 0.000006
+    sparcity = False
+    sparcity_amount = 0
+    comp_std = 0.05
+    comp_sparcity = 0.7
+    off_target_interactions = False
+
+    starting_abundances = generate_abundances(n, sa_seed, sa_mean, sa_std)
+    community_settings = (ri_mean, ri_std, cc_mean, cc_std, interact_mean, interact_std, sparcity, sparcity_amount, comp_std, comp_sparcity, off_target_interactions)
+    table = screen_communities(n, screening_maxtime if steady_state else maxtime, time_increment, starting_abundances, random_seed_pairs(pairs, screening_seed), community_settings, min_abundance, min_coexisting, steady_state=steady_state)
+    table.to_csv(output_name, index=False)
+    print(table.head(20))
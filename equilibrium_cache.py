@@ -0,0 +1,83 @@
+import os
+import hashlib
+import tempfile
+import numpy as np
+from collections import OrderedDict
+from scipy.sparse import issparse
+
+''' Cache for resident (leave-one-out) equilibria used in invasion studies, so that the same
+resident community isn't simulated again for every invasion attempt of a mutant.
+
+equilibrium_key: Returns a hash of the given parts (numpy arrays, scipy.sparse matrices, numbers
+and strings). Arrays are hashed by their shape and values.
+
+EquilibriumCache: In-memory least recently used cache of at most maxsize equilibria keyed by
+equilibrium_key. If a directory is given the equilibria are also saved there as .npy files and
+read from there when they are not in memory, so the cache is shared between processes and
+runs. Files are written to a temporary file and renamed, so readers never see partial files.
+    get: Returns the cached equilibrium for the key, or None.
+    put: Stores an equilibrium for the key.
+    get_or_compute: Returns the cached equilibrium, or calls compute() and stores the result
+    if it isn't an error code.
+'''
+
+def equilibrium_key(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        if issparse(part):
+            part = part.tocsr()
+            digest.update(str(part.shape).encode())
+            for array in (part.data, part.indices, part.indptr):
+                digest.update(np.ascontiguousarray(array).tobytes())
+        elif isinstance(part, np.ndarray):
+            digest.update(str(part.shape).encode())
+            digest.update(np.ascontiguousarray(part, dtype=float).tobytes())
+        else:
+            digest.update(repr(part).encode())
+        digest.update(b"|")
+    return digest.hexdigest()
+
+class EquilibriumCache:
+    def __init__(self, maxsize=128, directory=None):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.memory = OrderedDict()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.npy")
+
+    def get(self, key):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return self.memory[key].copy()
+        if self.directory is not None and os.path.exists(self.path(key)):
+            equilibrium = np.load(self.path(key))
+            self.remember(key, equilibrium)
+            return equilibrium.copy()
+        return None
+
+    def remember(self, key, equilibrium):
+        self.memory[key] = equilibrium
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
+
+    def put(self, key, equilibrium):
+        equilibrium = np.array(equilibrium, dtype=float)
+        self.remember(key, equilibrium)
+        if self.directory is not None:
+            # Written to a temporary file first, so other processes never read a partly written file
+            with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".npy", delete=False) as handle:
+                np.save(handle, equilibrium)
+            os.replace(handle.name, self.path(key))
+
+    def get_or_compute(self, key, compute):
+        equilibrium = self.get(key)
+        if equilibrium is not None:
+            return equilibrium
+        equilibrium = compute()
+        if type(equilibrium) != int:
+            self.put(key, equilibrium)
+        return equilibrium
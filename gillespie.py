@@ -0,0 +1,148 @@
+import numpy as np
+from scipy.sparse import issparse, csc_matrix
+from sim_gLV_RK import find_rng
+
+''' Individual based stochastic simulation of generalized Lotka-Volterra dynamics with the
+Gillespie stochastic simulation algorithm (SSA) and adaptive tau-leaping.
+
+Abundances are whole individuals. The gLV rate of change of species i, N_i(r_i + sum_j A_ij N_j),
+is split into birth and death propensities:
+birth_i = N_i(r_i+ + sum_j A_ij+ N_j + sigma_i/2)
+death_i = N_i(r_i- + sum_j A_ij- N_j + sigma_i/2)
+where x+ and x- are the positive and negative parts of x. The difference of the propensities
+is the gLV rate and the optional sigma adds equal birth and death rates, which gives the same
+variance N_i*sigma_i per unit time as the noise term of the diffusion approximation in
+stochastic_gLV_RK. Unlike the diffusion approximation this is exact at low abundances, such as
+a mutant invading from a few individuals.
+
+gillespie_rates: Collects the rate structure used by the other functions: positive and negative
+parts of the growth rates and interactions, and for each species j the dependency graph of
+species whose propensities depend on it (nonzero A_ij, and j itself) with the matching
+interaction values. For sparse interaction matrices only the stored entries are visited.
+
+gillespie_propensities: Returns the birth and death propensities and the interaction sums
+A+N and A-N for the given abundances.
+
+ssa_events: Exact SSA (direct method) for at most max_events events or until t_end. After each
+event only the propensities of the dependent species are updated.
+
+tau_leap: One adaptive tau-leap. The leap length is chosen so that the expected relative change
+of each species' propensities is at most epsilon (Cao, Gillespie and Petzold 2006), births
+and deaths of all species are drawn at once from Poisson distributions and leaps that would
+make an abundance negative are retried with half the length. Returns None in stead of the new
+state if the leap would be so short that exact simulation is cheaper.
+
+gillespie_advance: Advances abundances from time t to t_end, with tau-leaping where it is
+efficient and exact SSA elsewhere (method="adaptive"), or only exact SSA (method="exact").
+If stop is given (a function of the abundances), returns as soon as stop is True.
+
+gillespie_gLV: Simulates the community with the same inputs and outputs as gLV_RK,
+recording abundances on the time_increment grid, and sigma, rng and method as above.
+'''
+
+def gillespie_rates(ri, interactions, sigma=None):
+    n = len(ri)
+    ri = np.asarray(ri, dtype=float)
+    noise = np.zeros(n) if sigma is None else np.asarray(sigma, dtype=float)/2
+    columns = csc_matrix(interactions)
+    columns.eliminate_zeros()
+    dependents = []
+    positive_columns = []
+    negative_columns = []
+    for j in range(n):
+        rows = columns.indices[columns.indptr[j]:columns.indptr[j+1]]
+        values = columns.data[columns.indptr[j]:columns.indptr[j+1]]
+        if j not in rows:
+            rows = np.append(rows, j)
+            values = np.append(values, 0.0)
+        dependents.append(rows)
+        positive_columns.append(np.maximum(values, 0))
+        negative_columns.append(np.maximum(-values, 0))
+    positive = columns.maximum(0).tocsr()
+    negative = (-columns).maximum(0).tocsr()
+    if not issparse(interactions):
+        positive = positive.toarray()
+        negative = negative.toarray()
+    return {"birth": np.maximum(ri, 0)+noise, "death": np.maximum(-ri, 0)+noise, "positive": positive, "negative": negative, "dependents": dependents, "positive_columns": positive_columns, "negative_columns": negative_columns}
+
+def gillespie_propensities(abundances, rates):
+    positive_sum = rates["positive"]@abundances
+    negative_sum = rates["negative"]@abundances
+    births = abundances*(rates["birth"]+positive_sum)
+    deaths = abundances*(rates["death"]+negative_sum)
+    return births, deaths, positive_sum, negative_sum
+
+def ssa_events(abundances, rates, t, t_end, max_events, rng, stop=None):
+    n = len(abundances)
+    births, deaths, positive_sum, negative_sum = gillespie_propensities(abundances, rates)
+    propensities = np.concatenate((births, deaths))
+    for event in range(max_events):
+        total = np.sum(propensities)
+        if total <= 0:
+            return abundances, t_end
+        t += rng.exponential(1/total)
+        if t >= t_end:
+            return abundances, t_end
+        reaction = np.searchsorted(np.cumsum(propensities), rng.random()*total, side='right')
+        reaction = min(reaction, 2*n-1)
+        species = reaction % n
+        change = 1.0 if reaction < n else -1.0
+        abundances[species] += change
+        rows = rates["dependents"][species]
+        positive_sum[rows] += change*rates["positive_columns"][species]
+        negative_sum[rows] += change*rates["negative_columns"][species]
+        propensities[rows] = abundances[rows]*(rates["birth"][rows]+positive_sum[rows])
+        propensities[rows+n] = abundances[rows]*(rates["death"][rows]+negative_sum[rows])
+        if stop is not None and stop(abundances):
+            return abundances, t
+    return abundances, t
+
+def tau_leap(abundances, rates, t, t_end, epsilon, rng, minimum_events=10):
+    births, deaths, positive_sum, negative_sum = gillespie_propensities(abundances, rates)
+    total = np.sum(births)+np.sum(deaths)
+    if total <= 0:
+        return abundances, t_end
+    drift = births-deaths
+    variance = births+deaths
+    bound = np.maximum(epsilon*abundances/2, 1)
+    with np.errstate(divide='ignore'):
+        tau = min(np.min(np.where(drift != 0, bound/np.abs(drift), np.inf)), np.min(np.where(variance > 0, bound**2/variance, np.inf)))
+    if tau < minimum_events/total:
+        return None
+    tau = min(tau, t_end-t)
+    while True:
+        new_abundances = abundances+rng.poisson(births*tau)-rng.poisson(deaths*tau)
+        if np.all(new_abundances >= 0):
+            return new_abundances.astype(float), t+tau
+        tau = tau/2
+        if tau < minimum_events/total:
+            return None
+
+def gillespie_advance(abundances, rates, t, t_end, rng, method="adaptive", epsilon=0.03, stop=None, exact_events=100):
+    while t < t_end:
+        if method == "adaptive":
+            leap = tau_leap(abundances, rates, t, t_end, epsilon, rng)
+            if leap is not None:
+                abundances, t = leap
+                if stop is not None and stop(abundances):
+                    return abundances, t
+                continue
+        abundances, t = ssa_events(abundances, rates, t, t_end, exact_events, rng, stop)
+        if stop is not None and stop(abundances):
+            return abundances, t
+    return abundances, t
+
+def gillespie_gLV(n, maxtime, time_increment, interactions, ri, starting_abundances, sigma=None, rng=None, method="adaptive", epsilon=0.03):
+    rng = find_rng(rng)
+    rates = gillespie_rates(ri, interactions, sigma)
+    max_increments = int(maxtime*(1/time_increment))
+    abundances = np.zeros((max_increments+1, n))
+    state = np.around(np.asarray(starting_abundances, dtype=float))
+    abundances[0] = state
+    t = 0.0
+    for time in range(1, max_increments+1):
+        state, t = gillespie_advance(state, rates, t, time*time_increment, rng, method, epsilon)
+        abundances[time] = state
+        if not np.any(state > 0):
+            break
+    return abundances
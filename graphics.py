@@ -6,6 +6,9 @@ import numpy as np
 functions:
 abundances_line_chart: Draws a line chart of the given abundance data.
 
+abundances_line_chart_with_ET: Same as previous, with the establishment threshold of an invading
+mutant drawn as a horizontal line.
+
 interactions heatmap: Draws a heatmap based on the given interactions between species.
 """
 
@@ -23,6 +26,21 @@ def abundances_line_chart(n, time_increment, abundances):
     plt.legend(range(1,n+1), title="Species", loc="center left", fontsize='small', bbox_to_anchor=(1, 0.5))
     return plt.show()
 
+def abundances_line_chart_with_ET(n, time_increment, abundances, ET):
+    times, species = np.shape(abundances)
+    x = []
+    value = 0
+    for i in range(0, times):
+        x.append(value)
+        value += time_increment
+    plt.figure()
+    plt.plot(x, abundances)
+    plt.axhline(y=ET, color="black", linestyle="--", label="ET")
+    plt.xlabel("Time")
+    plt.ylabel("Abundance")
+    plt.legend(list(range(1,n+1))+["ET"], title="Species", loc="center left", fontsize='small', bbox_to_anchor=(1, 0.5))
+    return plt.show()
+
 def abundances_and_nutrient_chart(n, maxtime, time_increment, abundances, nutrient):
     times, species = np.shape(abundances)
     x = []
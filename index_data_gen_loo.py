@@ -16,7 +16,7 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from parameters import generate_growth_rates, generate_interactions, generate_abundances, add_sparcity, adjust_selfinteractions_for_carrying_capacity, generate_loo_starting_abundances
-from sim_gLV_RK import gLV_RK
+from sim_gLV_RK import gLV_RK, batch_gLV_RK
 from Cyclic_games import random_win_lose_system, random_competition_system
 from graphics import abundances_line_chart
 from create_data_outputs import initiate_df, output, relative_abundances, addable_to_frame
@@ -125,23 +125,38 @@ columns, relative_abund_df = initiate_df(n)
 
 sampled_times = np.linspace(0, int(maxtime*(1/time_increment)), num=no_of_samples).astype(int)
 
-abundances = gLV_RK(n, maxtime, time_increment, pairwise_interactions, ri, whole_com_starting_abundances)
-
+#Whole trajectories are only stored when figures are saved, otherwise simulations keep just the sampled time points
 if save_figures_of_communities:
-    plt.plot(list(range(int(maxtime*(1/time_increment))+1)), abundances)
-    plt.title(f"Whole community")
-    plt.xlabel("Time")
-    plt.ylabel("Abundance")
-    plt.savefig(f"{output_name}_whole_community.png")
-    plt.clf()
-
-sample = np.take(abundances, sampled_times, axis=0)
-absolute_abund_df = absolute_abund_df.append(addable_to_frame(columns, 0, sampled_times, sample))
-rel_data = relative_abundances(sample)
-relative_abund_df = relative_abund_df.append(addable_to_frame(columns, 0, sampled_times, rel_data))
+    recorded_times = np.arange(int(maxtime*(1/time_increment))+1)
+else:
+    recorded_times = np.unique(sampled_times)
+sample_rows = np.searchsorted(recorded_times, sampled_times)
+
+abundances = gLV_RK(n, maxtime, time_increment, pairwise_interactions, ri, whole_com_starting_abundances, recorded_times)
+
+if type(abundances) == int:
+    print("Encountered error in whole community simulation, it is left out of the data")
+else:
+    if save_figures_of_communities:
+        plt.plot(list(range(int(maxtime*(1/time_increment))+1)), abundances)
+        plt.title(f"Whole community")
+        plt.xlabel("Time")
+        plt.ylabel("Abundance")
+        plt.savefig(f"{output_name}_whole_community.png")
+        plt.clf()
+
+    sample = np.take(abundances, sample_rows, axis=0)
+    absolute_abund_df = absolute_abund_df.append(addable_to_frame(columns, 0, sampled_times, sample))
+    rel_data = relative_abundances(sample)
+    relative_abund_df = relative_abund_df.append(addable_to_frame(columns, 0, sampled_times, rel_data))
+
+loo_abundances, loo_status = batch_gLV_RK(n, maxtime, time_increment, pairwise_interactions, ri, starting_abundances, recorded_times)
 
 for i in range(len(starting_abundances)):
-    abundances = gLV_RK(n, maxtime, time_increment, pairwise_interactions, ri, starting_abundances[i])
+    if loo_status[i] == -1:
+        print(f"Encountered error with species {i+1} left out, it is left out of the data")
+        continue
+    abundances = loo_abundances[i]
     if save_figures_of_communities:
         plt.plot(list(range(int(maxtime*(1/time_increment))+1)), abundances)
         plt.title(f"Species left out: {i+1}")
@@ -149,7 +164,7 @@ for i in range(len(starting_abundances)):
         plt.ylabel("Abundance")
         plt.savefig(f"{output_name}_leave_{i+1}_out.png")
         plt.clf()
-    sample = np.take(abundances, sampled_times, axis=0)
+    sample = np.take(abundances, sample_rows, axis=0)
     absolute_abund_df = absolute_abund_df.append(addable_to_frame(columns, i+1, sampled_times, sample))
     rel_data = relative_abundances(sample)
     relative_abund_df = relative_abund_df.append(addable_to_frame(columns, i+1, sampled_times, rel_data))
@@ -1,8 +1,15 @@
 ### LIBRARIES ###
 
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.stats import norm
 from simulations_simple_gLV import stochastic_simple_gLV_with_extinction
 from graphics import abundances_line_chart, abundances_line_chart_with_ET
+from replicates import run_replicate
+from equilibrium_cache import equilibrium_key
+from GLV_steady_state_calculator import solve_interactions
+from splitting import establishment_splitting
+from stability import community_matrix, leading_eigenvalue, loo_stability
 
 ### DESCRIPTION ###
 
@@ -13,9 +20,35 @@ Functions:
 r_mutant_calculator: this function calculates the growth rate of the mutant after it is inserted in a leave-one-out 
 community at equilibrium. The equilibrium abundances should include the invasion abundance of the mutant.
 
+loo_equilibrium: simulates the leave-one-out community without the mutant (on copies of the inputs) until
+all residents survive, at most maxtime attempts. Returns the equilibrium abundances, "-3" if it could not
+be formed or the error code of the simulation.
+
+feasible_and_stable: True if all equilibrium abundances are positive and all eigenvalues of the community
+matrix diag(N*)A have negative real parts.
+
+analytic_loo_equilibrium: solves the leave-one-out equilibrium of the deterministic model directly with
+GLV_steady_state_calculator.solve_interactions. Returns the equilibrium (with 0 for the mutant) if it is
+feasible and stable, "-3" if not.
+
+invasion_screen: deterministic screen of all n mutants without any simulation. All leave-one-out
+equilibria and the leading eigenvalues of their community matrices are found with
+stability.loo_stability (batched eigenvalue solves) and for each viable one (feasible and stable) the growth
+rate r_mutant of the mutant inserted with its starting abundance is calculated. Returns r_mutant (NaN
+where the equilibrium isn't viable), the viable mask and the leave-one-out equilibria.
+
+resident_equilibrium: with analytic=True the equilibrium is taken from analytic_loo_equilibrium, and only
+simulated if it isn't feasible and stable. Otherwise loo_equilibrium through an equilibrium_cache.EquilibriumCache if one is given. The
+cache key is a hash of the interactions, ri, sigma and starting abundances of the residents, the excluded
+mutant, the time settings and the seed policy: with seed_policy None one stochastic equilibrium is shared
+by all invasion attempts, with an integer seed_policy the global random state is seeded with it for the
+simulation so that the cached equilibrium is reproducible, and restored afterwards so that the rest of the
+random stream is the same whether the equilibrium was cached or not.
+
 invasion: returns the abundances of all species (including the mutant) after a single invasion of a mutant (if the 
-leave_one_out equilibrium can be obtained). It also returns the growth rates of the species, which are the same as the initial ones, 
-except for the mutant (which now obeys the result calculated by the r_mutant_calculator).
+leave_one_out equilibrium can be obtained). It also returns a copy of the growth rates of the species, which are the same as the initial ones, 
+except for the mutant (which now obeys the result calculated by the r_mutant_calculator). The given ri isn't changed. The leave-one-out
+equilibrium can be given, otherwise it is found with resident_equilibrium (analytic as above).
 
 ET_calculator: calculates the establishment threshold (N*sigma_i)/((2*N*r_mutant)-mean(sigma)). 
 It is used in the multiple single species invasion function.
@@ -24,10 +57,36 @@ multiple_different_species_invasions: cycles the species checking if they can in
 at equilibrium (with invasion abundances being defined by the given initial abundances), 
 according to the invasion function above. A plot is printed for each successful try and the function returns the grid with the 
 final abundances after the invasion event (the rows specify the species that attempted the invasion).
+With analytic=True the resident equilibria are solved directly where they are feasible and stable.
 
 multiple_single_species_invasions: given an array of different invasion abundances, the function checks if a single mutant
 can invade the leave-one-out community at equilibrium with the different abundances. ETs are calculated and returned according
-to the ET_calculator above, together with the final abundances after each invasion attempt.
+to the ET_calculator above, together with the final abundances after each invasion attempt. The
+leave-one-out equilibrium is found once and used for all invasion abundances.
+
+establishment_trial: Runs one invasion on copies of the inputs and returns 1 if the mutant
+has at least establishment_abundance at the end, 0 if not, or the error code of invasion.
+
+wilson_interval: Wilson score confidence interval for a probability from successes and trials.
+
+establishment_probability: Monte Carlo estimate of the establishment probability of a mutant
+for each of the given invasion abundances. Invasions are repeated in batches of batch_size
+over a process pool (workers=1 runs in the calling process) until the confidence interval of
+the probability is at most target_width wide or max_replicates trials have been run, so
+replicates are only spent on invasion abundances where the answer is still uncertain. Each
+trial has its own random stream spawned from numpy.random.SeedSequence(seed), so the results
+are reproducible for any number of workers. Trials where the leave-one-out equilibrium
+could not be formed are not counted. Returns the probabilities, the (k, 2) confidence
+intervals and the number of counted trials for each invasion abundance. If a cache is given the resident
+equilibrium is found once with resident_equilibrium and shared by all trials.
+
+rare_establishment_probability: estimate for establishment probabilities that are too small for
+establishment_probability (far below the ET_calculator threshold). The growth rate of the mutant is set
+from the resident equilibrium as in invasion and splitting.establishment_splitting estimates the
+probability that the mutant has at least establishment_abundance at the end of the simulation, with
+the same model as invasion, so the estimate is of the same probability as establishment_probability.
+Returns the probability, the conditional probabilities of the stages and the relative error, or the
+error code of resident_equilibrium.
 
 """
 
@@ -37,38 +96,93 @@ def r_mutant_calculator(loo_interactions, loo_equilibrium_abundances, mutant_pos
     r_mutant = (-1)*sum(loo_interactions[mutant_position]*loo_equilibrium_abundances)
     return r_mutant
 
-def invasion(n, maxtime, ri, starting_abundances, pairwise_interactions, sigma, mutant):
+def loo_equilibrium(n, maxtime, time_increment, ri, starting_abundances, pairwise_interactions, sigma, mutant):
     mutant = mutant - 1
-    # Storing starting abundance of the mutant
-    N_invasion = starting_abundances[mutant]
-    # Deleting starting abundance of the mutant (so we can find leave_one_out equilibrium)
+    # Leave-one-out community is simulated without the mutant and its noise, on copies so the inputs are not changed
+    starting_abundances = np.array(starting_abundances, dtype=float)
     starting_abundances[mutant] = 0
-    # Storing sigma of the mutant to use it later (equating it to zero eliminates the noise of the mutant, which is needed in the leave-one-out equilibrium).
-    save_sigma_mutant = sigma[mutant]
+    sigma = np.array(sigma, dtype=float)
     sigma[mutant] = 0
-    # Notice "loo" means leave-one-out in what follows.
-    loo_equilibrium_abundances = np.zeros(n)
     t = 0
     while t<maxtime:
-        loo_equilibrium_abundances = stochastic_simple_gLV_with_extinction(n, maxtime, pairwise_interactions, ri, starting_abundances, sigma)
+        loo_equilibrium_abundances = stochastic_simple_gLV_with_extinction(n, maxtime, time_increment, pairwise_interactions, ri, starting_abundances, sigma)
+        if type(loo_equilibrium_abundances) == int:
+            return loo_equilibrium_abundances
+        loo_equilibrium_abundances = loo_equilibrium_abundances[-1]
+        if all(np.delete(loo_equilibrium_abundances, mutant)):
+            return loo_equilibrium_abundances
+        t+=1
+    return -3
+
+def feasible_and_stable(equilibrium_abundances, interactions):
+    if not np.all(equilibrium_abundances > 0):
+        return False
+    return bool(leading_eigenvalue(community_matrix(equilibrium_abundances, interactions)) < 0)
+
+def analytic_loo_equilibrium(n, ri, pairwise_interactions, mutant):
+    mutant = mutant - 1
+    keep = np.delete(np.arange(n), mutant)
+    loo_interactions = pairwise_interactions[keep][:, keep]
+    try:
+        residents = solve_interactions(loo_interactions, -np.asarray(ri, dtype=float)[keep])
+    except np.linalg.LinAlgError:
+        return -3
+    if not feasible_and_stable(residents, loo_interactions):
+        return -3
+    return np.insert(residents, mutant, 0)
+
+def invasion_screen(n, ri, pairwise_interactions, starting_abundances):
+    loo_abundances, feasible, eigenvalues = loo_stability(n, np.asarray(ri, dtype=float), pairwise_interactions, feasible_only=True)
+    viable = feasible & (eigenvalues < 0)
+    r_mutants = np.full(n, np.nan)
+    for i in range(n):
+        if viable[i]:
+            loo_abundances[i][i] = starting_abundances[i]
+            r_mutants[i] = r_mutant_calculator(pairwise_interactions, loo_abundances[i], i)
+            loo_abundances[i][i] = 0
+    return r_mutants, viable, loo_abundances
+
+def resident_equilibrium(n, maxtime, time_increment, ri, starting_abundances, pairwise_interactions, sigma, mutant, cache=None, seed_policy=None, analytic=False):
+    if analytic:
+        loo_equilibrium_abundances = analytic_loo_equilibrium(n, ri, pairwise_interactions, mutant)
         if type(loo_equilibrium_abundances) != int:
-            loo_equilibrium_abundances = loo_equilibrium_abundances[-1]
-            loo_equilibrium_abundances[mutant] = N_invasion
-            if all(loo_equilibrium_abundances) > 0:
-                break
-            else:
-                t+=1
-        else:
-            return loo_equilibrium_abundances, ri
-    if t>=maxtime:
-        return -3, ri
+            return loo_equilibrium_abundances
+    def compute():
+        if seed_policy is None:
+            return loo_equilibrium(n, maxtime, time_increment, ri, starting_abundances, pairwise_interactions, sigma, mutant)
+        # The global random state is restored afterwards, so later simulations don't depend on cache hits
+        random_state = np.random.get_state()
+        np.random.seed(seed_policy)
+        try:
+            return loo_equilibrium(n, maxtime, time_increment, ri, starting_abundances, pairwise_interactions, sigma, mutant)
+        finally:
+            np.random.set_state(random_state)
+    if cache is None:
+        return compute()
+    residents = np.array(starting_abundances, dtype=float)
+    residents[mutant-1] = 0
+    resident_sigma = np.array(sigma, dtype=float)
+    resident_sigma[mutant-1] = 0
+    policy = "shared" if seed_policy is None else seed_policy
+    key = equilibrium_key(pairwise_interactions, np.asarray(ri, dtype=float), resident_sigma, residents, mutant, maxtime, time_increment, policy)
+    return cache.get_or_compute(key, compute)
+
+def invasion(n, maxtime, time_increment, ri, starting_abundances, pairwise_interactions, sigma, mutant, cache=None, seed_policy=None, loo_equilibrium_abundances=None, analytic=False):
+    # Notice "loo" means leave-one-out in what follows.
+    if loo_equilibrium_abundances is None:
+        loo_equilibrium_abundances = resident_equilibrium(n, maxtime, time_increment, ri, starting_abundances, pairwise_interactions, sigma, mutant, cache, seed_policy, analytic)
+    if type(loo_equilibrium_abundances) == int:
+        return loo_equilibrium_abundances, ri
+    mutant = mutant - 1
+    # The mutant is inserted in the leave-one-out equilibrium with its invasion abundance
+    loo_equilibrium_abundances = np.array(loo_equilibrium_abundances, dtype=float)
+    loo_equilibrium_abundances[mutant] = starting_abundances[mutant]
     # Find the new growth rate of the mutant (based on the loo equilibrium)
     r_mutant = r_mutant_calculator(pairwise_interactions, loo_equilibrium_abundances, mutant)
+    # The growth rates are copied so that the caller's ri (used for the next mutants) isn't changed
+    ri = np.array(ri, dtype=float)
     ri[mutant] = r_mutant
-    # Reassign stored variables
-    sigma[mutant] = save_sigma_mutant
-    starting_abundances[mutant] = N_invasion
-    final_abundances = stochastic_simple_gLV_with_extinction(n, maxtime, pairwise_interactions, ri, starting_abundances, sigma)  
+    final_abundances = stochastic_simple_gLV_with_extinction(n, maxtime, time_increment, pairwise_interactions, ri, starting_abundances, sigma)
     return final_abundances, ri
 
 def ET_calculator(sigma, ri, mutant_position, starting_abundances):
@@ -76,11 +190,11 @@ def ET_calculator(sigma, ri, mutant_position, starting_abundances):
     ET = (sum(starting_abundances)*sigma[mutant_position])/denominator
     return ET
 
-def multiple_different_species_invasions(n, maxtime, ri, starting_abundances, pairwise_interactions, sigma):
+def multiple_different_species_invasions(n, maxtime, time_increment, ri, starting_abundances, pairwise_interactions, sigma, cache=None, seed_policy=None, analytic=False):
     # Here the invasion_abundances refer to the n different species
     final_abundances_after_invasions = np.zeros((n,n))
     for i in range(n):
-        final_abundances, r_mutant = invasion(n, maxtime, ri, starting_abundances, pairwise_interactions, sigma, i)
+        final_abundances, r_mutant = invasion(n, maxtime, time_increment, ri, starting_abundances, pairwise_interactions, sigma, i+1, cache, seed_policy, analytic=analytic)
         if type(final_abundances) == int:
             if final_abundances == -1:
                 print("Nonviable")
@@ -105,19 +219,21 @@ def multiple_different_species_invasions(n, maxtime, ri, starting_abundances, pa
                 print(f"Mutant {i+1} cannot invade")
                 print()
             final_abundances_after_invasions[i] = final_abundances[-1]
-            abundances_line_chart(n, maxtime, final_abundances)
+            abundances_line_chart(n, time_increment, final_abundances)
             #interactions_heatmap(n, pairwise_interactions)
     return final_abundances_after_invasions
 
-def multiple_single_species_invasions(n, maxtime, ri, starting_abundances, pairwise_interactions, sigma, mutant, invasion_abundances):
+def multiple_single_species_invasions(n, maxtime, time_increment, ri, starting_abundances, pairwise_interactions, sigma, mutant, invasion_abundances, cache=None, seed_policy=None):
     mutant = mutant - 1
     # Here the invasion_abundances refer to the same mutant species
     k = np.size(invasion_abundances)
     final_abundances_after_invasions = np.zeros((k,n))
     ETs = np.zeros(k)
+    # The resident community is the same for all invasion abundances, so its equilibrium is found only once
+    loo_equilibrium_abundances = resident_equilibrium(n, maxtime, time_increment, ri, starting_abundances, pairwise_interactions, sigma, mutant+1, cache, seed_policy)
     for i in range(k):
         starting_abundances[mutant] = invasion_abundances[i]
-        final_abundances, r_mutant = invasion(n, maxtime, ri, starting_abundances, pairwise_interactions, sigma, mutant)
+        final_abundances, r_mutant = invasion(n, maxtime, time_increment, ri, starting_abundances, pairwise_interactions, sigma, mutant+1, loo_equilibrium_abundances=loo_equilibrium_abundances)
         if type(final_abundances) == int:
             if final_abundances == -1:
                 print("Nonviable")
@@ -144,5 +260,73 @@ def multiple_single_species_invasions(n, maxtime, ri, starting_abundances, pairw
             final_abundances_after_invasions[i] = final_abundances[-1]
             ET = ET_calculator(sigma, r_mutant, mutant, starting_abundances)
             ETs[i] = ET
-            abundances_line_chart_with_ET(n, maxtime, final_abundances, ET)
+            abundances_line_chart_with_ET(n, time_increment, final_abundances, ET)
     return final_abundances_after_invasions, np.around(ETs, decimals=4)
+
+def establishment_trial(n, maxtime, time_increment, ri, starting_abundances, pairwise_interactions, sigma, mutant, establishment_abundance, loo_equilibrium_abundances=None):
+    final_abundances, r = invasion(n, maxtime, time_increment, np.array(ri, dtype=float), np.array(starting_abundances, dtype=float), pairwise_interactions, np.array(sigma, dtype=float), mutant, loo_equilibrium_abundances=loo_equilibrium_abundances)
+    if type(final_abundances) == int:
+        return final_abundances
+    return int(final_abundances[-1][mutant-1] >= establishment_abundance)
+
+def wilson_interval(successes, trials, confidence=0.95):
+    if trials == 0:
+        return 0.0, 1.0
+    z = norm.ppf((1+confidence)/2)
+    p = successes/trials
+    centre = (p+z**2/(2*trials))/(1+z**2/trials)
+    half_width = z/(1+z**2/trials)*np.sqrt(p*(1-p)/trials+z**2/(4*trials**2))
+    return max(0.0, centre-half_width), min(1.0, centre+half_width)
+
+def establishment_probability(n, maxtime, time_increment, ri, starting_abundances, pairwise_interactions, sigma, mutant, invasion_abundances, establishment_abundance=0.0005, target_width=0.1, max_replicates=1000, batch_size=50, seed=None, workers=None, confidence=0.95, cache=None, seed_policy=None):
+    k = np.size(invasion_abundances)
+    loo_equilibrium_abundances = None
+    if cache is not None:
+        loo_equilibrium_abundances = resident_equilibrium(n, maxtime, time_increment, ri, starting_abundances, pairwise_interactions, sigma, mutant, cache, seed_policy)
+        if type(loo_equilibrium_abundances) == int:
+            return np.full(k, np.nan), np.tile([0.0, 1.0], (k, 1)), np.zeros(k, dtype=int)
+    seed_sequences = np.random.SeedSequence(seed).spawn(k)
+    successes = np.zeros(k, dtype=int)
+    trials = np.zeros(k, dtype=int)
+    attempts = np.zeros(k, dtype=int)
+    intervals = np.tile([0.0, 1.0], (k, 1))
+    uncertain = np.ones(k, dtype=bool)
+    pool = None if workers == 1 else ProcessPoolExecutor(max_workers=workers)
+    try:
+        while np.any(uncertain):
+            jobs = []
+            for i in np.flatnonzero(uncertain):
+                abundances = np.array(starting_abundances, dtype=float)
+                abundances[mutant-1] = np.ravel(invasion_abundances)[i]
+                trial_args = (n, maxtime, time_increment, ri, abundances, pairwise_interactions, sigma, mutant, establishment_abundance, loo_equilibrium_abundances)
+                batch = min(batch_size, max_replicates-attempts[i])
+                attempts[i] += batch
+                for seed_sequence in seed_sequences[i].spawn(batch):
+                    if pool is None:
+                        jobs.append((i, run_replicate(establishment_trial, trial_args, None, True, seed_sequence)))
+                    else:
+                        jobs.append((i, pool.submit(run_replicate, establishment_trial, trial_args, None, True, seed_sequence)))
+            for i, job in jobs:
+                result = job if pool is None else job.result()
+                if result in (0, 1):
+                    successes[i] += result
+                    trials[i] += 1
+            for i in np.flatnonzero(uncertain):
+                intervals[i] = wilson_interval(successes[i], trials[i], confidence)
+                if intervals[i][1]-intervals[i][0] <= target_width or attempts[i] >= max_replicates:
+                    uncertain[i] = False
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    probabilities = np.where(trials > 0, successes/np.maximum(trials, 1), np.nan)
+    return probabilities, intervals, trials
+
+def rare_establishment_probability(n, maxtime, time_increment, ri, starting_abundances, pairwise_interactions, sigma, mutant, establishment_abundance, number_of_levels=10, effort=1000, rng=None, cache=None, seed_policy=None, analytic=False):
+    loo_equilibrium_abundances = resident_equilibrium(n, maxtime, time_increment, ri, starting_abundances, pairwise_interactions, sigma, mutant, cache, seed_policy, analytic)
+    if type(loo_equilibrium_abundances) == int:
+        return loo_equilibrium_abundances
+    loo_equilibrium_abundances = np.array(loo_equilibrium_abundances, dtype=float)
+    loo_equilibrium_abundances[mutant-1] = starting_abundances[mutant-1]
+    ri = np.array(ri, dtype=float)
+    ri[mutant-1] = r_mutant_calculator(pairwise_interactions, loo_equilibrium_abundances, mutant-1)
+    return establishment_splitting(n, maxtime, time_increment, pairwise_interactions, ri, starting_abundances, sigma, mutant, establishment_abundance, number_of_levels=number_of_levels, effort=effort, rng=rng)
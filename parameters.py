@@ -1,5 +1,6 @@
 import numpy as np
 from scipy.stats import bernoulli
+from scipy.sparse import issparse, random as sparse_random
 from math import comb
 import random
 
@@ -22,11 +23,19 @@ add_sparcity: takes a 1- or 2-dimensional numpy array and a sparcity term. Uses
 to draw a boolean index from a bernouilli distribution, sets chosen indexes to zero on the
 given array.
 
+add_pairwise_sparcity: sets both interactions of a fraction sparcity of the species pairs to zero. Draws
+from the global NumPy random state, in the same pair order as the pairwise systems of Cyclic_games.py
+(pair k of np.triu_indices(n, 1) uses bernoulli draw number (n*(n-1)/2)-1-k).
+
 generate_interactions: Generates a matrix of interactions where rows are the affected species and
 columns the species effecting it. The order defines the interaction's order, 1 means pairwise
 interactions, 2 means tertiary and so on. Interactions are drawn from a normal distribution.
 Sparcity is introduced to the interactions by calling function add_sparcity.
 
+generate_sparse_interactions: Generates a scipy.sparse CSR matrix of pairwise interactions where
+a fraction "connectance" of the interactions are nonzero and drawn from a normal distribution.
+Used for large communities (thousands of species) where dense matrices are impractical.
+
 adjust_selfinteractions: Takes generated pairwise interactions and adjusts the diagonal terms,
 the pairwise interactions, and replaces them with values drawn from a normal distribution with
 the given mean and standard deviation.
@@ -35,7 +44,7 @@ adjust_selfinteractions_for_carrying_capacity: When using previous function with
 ri we often end up with some species having very low carrying capacities and some having high carrying
 capacities. In this function we give a carrying capacity for each species (drawn with
 generate_abundances) and this function calculates desired self-interaction with equation
-K = -ri/Aii -> Aii = -ri/K
+K = -ri/Aii -> Aii = -ri/K. Works for both numpy arrays and scipy.sparse matrices.
 
 generate_loo_interaction_matrices: Takes a pairwise interactions matrix and return a list
 of interactions matrices for leave-one-out simulations
@@ -107,13 +116,10 @@ def add_sparcity(array, sparcity, seed_sparcity):
 
 def add_pairwise_sparcity(n, pairwise_interactions, sparcity):
     draw = bernoulli(sparcity)
-    spar_list = list(map(bool, draw.rvs(int(((n*n)-n)/2))))
-    for i in range(n):
-        for j in range(i+1, n):
-            sparse = spar_list.pop()
-            if sparse:
-                pairwise_interactions[i][j] = 0
-                pairwise_interactions[j][i] = 0
+    sparse = np.array(draw.rvs(int(((n*n)-n)/2)), dtype=bool)[::-1]
+    i, j = np.triu_indices(n, 1)
+    pairwise_interactions[i[sparse], j[sparse]] = 0
+    pairwise_interactions[j[sparse], i[sparse]] = 0
     return pairwise_interactions
 
 def generate_interactions(n, order,seed_interactions, mean=0, std=0.1):
@@ -122,6 +128,11 @@ def generate_interactions(n, order,seed_interactions, mean=0, std=0.1):
     interactions = np.around((np.random.normal(loc=mean, scale=std, size=(n,columns))), decimals=8)
     return interactions
 
+def generate_sparse_interactions(n, seed_interactions, connectance, mean=0, std=0.1):
+    draw = np.random.RandomState(seed_interactions)
+    interactions = sparse_random(n, n, density=connectance, format='csr', random_state=draw, data_rvs=lambda size: np.around(draw.normal(loc=mean, scale=std, size=size), decimals=8))
+    return interactions
+
 def adjust_selfinteractions(n, interactions, seed_selfinter, mean=-0.1, std=0.1):
     np.random.seed(seed_selfinter)
     selfinteractions = np.around((np.random.normal(loc=mean, scale=abs(mean*std), size=n)), decimals=4)
@@ -133,8 +144,12 @@ def adjust_selfinteractions(n, interactions, seed_selfinter, mean=-0.1, std=0.1)
     return interactions
 
 def adjust_selfinteractions_for_carrying_capacity(n, interactions, ri, carrying_capacities):
-    for i in range(0,n):
-        interactions[i][i] = -(ri[i]/carrying_capacities[i])
+    selfinteractions = -(np.asarray(ri[:n])/np.asarray(carrying_capacities[:n]))
+    if issparse(interactions):
+        interactions = interactions.tolil()
+        interactions.setdiag(selfinteractions)
+        return interactions.tocsr()
+    interactions[np.arange(n), np.arange(n)] = selfinteractions
     return interactions
 
 def generate_abundance_call(species_list, available_species, choose):
@@ -156,10 +171,7 @@ def generate_abundance_call_with_repeats(species_list, available_species, choose
         return table
 
 def calculate_carrying_capacities(ri, interactions):
-    carrying_capacities = []
-    for i in range(0, len(ri)):
-        carrying_capacities.append(np.around((-ri[i]/interactions[i][i]),decimals=4))
-    return np.array(carrying_capacities)
+    return np.around(-np.asarray(ri)/interactions.diagonal()[:len(ri)], decimals=4)
 
 def generate_sigma(n, seed_sigma, mean=0.1, std=1):
     np.random.seed(seed_sigma)
@@ -0,0 +1,79 @@
+import numpy as np
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from sim_gLV_RK import stochastic_gLV_RK
+
+''' Running replicates of stochastic simulations in parallel.
+
+Each replicate gets its own random stream, a child spawned from numpy.random.SeedSequence(seed),
+so the results only depend on the seed and the replicate number and are bit-reproducible for
+any number of worker processes. Simulators that take a numpy.random.Generator as keyword
+argument rng (stochastic_gLV_RK, numba_stochastic_gLV_RK) get a Generator of their own stream.
+Legacy simulators that use the global NumPy random state, such as
+old_models.simulations_simple_gLV.stochastic_simple_gLV_with_extinction, can be run with
+legacy_seeding=True, in which case the global random state of the worker is seeded from the
+replicate's stream before the simulation and restored afterwards (so with workers=1 the random
+stream of the calling process is the same as before the replicates). Simulators and summary
+functions have to be defined on module level so that they can be sent to the worker processes.
+
+final_abundances: Example summary function, returns the abundances at the last timepoint.
+
+run_replicate: Runs a single replicate with the given SeedSequence and returns the trajectory,
+its summary if a summary function is given, or the error code of the simulator.
+
+replicate_stream: Generator that runs the replicates over a process pool of the given number
+of workers (all cores by default, workers=1 runs in the calling process) and yields
+(replicate number, result) in replicate order as results become available, so per replicate
+summaries can be processed without keeping all trajectories in memory.
+
+run_replicates: Collects the results of replicate_stream. Returns a stacked array of the results
+where failed replicates are filled with NaN, and a vector of the replicates that succeeded.
+Returns "-1" if all replicates failed.
+
+stochastic_replicates: Runs replicates of stochastic_gLV_RK (or the given simulator with the same
+inputs) of one community.
+'''
+
+def final_abundances(trajectory):
+    return trajectory[-1]
+
+def run_replicate(simulator, simulator_args, summary, legacy_seeding, seed_sequence):
+    if legacy_seeding:
+        # The global random state is restored afterwards, so replicates run in the calling process don't change its random stream
+        random_state = np.random.get_state()
+        np.random.seed(seed_sequence.generate_state(1)[0])
+        try:
+            result = simulator(*simulator_args)
+        finally:
+            np.random.set_state(random_state)
+    else:
+        result = simulator(*simulator_args, rng=np.random.default_rng(seed_sequence))
+    if type(result) == int or summary is None:
+        return result
+    return summary(result)
+
+def replicate_stream(simulator, simulator_args, replicates, seed, workers=None, summary=None, legacy_seeding=False, chunksize=1):
+    seed_sequences = np.random.SeedSequence(seed).spawn(replicates)
+    replicate = partial(run_replicate, simulator, simulator_args, summary, legacy_seeding)
+    if workers == 1:
+        for i, seed_sequence in enumerate(seed_sequences):
+            yield i, replicate(seed_sequence)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for i, result in enumerate(pool.map(replicate, seed_sequences, chunksize=chunksize)):
+            yield i, result
+
+def run_replicates(simulator, simulator_args, replicates, seed, workers=None, summary=None, legacy_seeding=False, chunksize=1):
+    results = [result for i, result in replicate_stream(simulator, simulator_args, replicates, seed, workers, summary, legacy_seeding, chunksize)]
+    succeeded = np.array([type(result) != int for result in results])
+    if not np.any(succeeded):
+        return -1
+    shape = np.shape(results[np.argmax(succeeded)])
+    stacked = np.full((replicates,)+shape, np.nan)
+    for i in np.flatnonzero(succeeded):
+        stacked[i] = results[i]
+    return stacked, succeeded
+
+def stochastic_replicates(n, maxtime, time_increment, interactions, ri, starting_abundances, sigma, replicates, seed, workers=None, summary=None, simulator=stochastic_gLV_RK):
+    simulator_args = (n, maxtime, time_increment, interactions, ri, starting_abundances, sigma)
+    return run_replicates(simulator, simulator_args, replicates, seed, workers, summary)
@@ -1,177 +1,728 @@
 import numpy as np
+from scipy.linalg import lu_factor, lu_solve
+from scipy.sparse import issparse, diags, identity, csc_matrix
+from GLV_steady_state_calculator import solve_interactions, interactions_solver, saturated_steady_state_glv, check_saturated_steady_state_stable
 
 ''' Functions for performing simulations with generalized Lotka-Volterra dynamics
 using the fourth order Runge-Kutta method to find the approximate solutions.
 All of the functions model extinction by dropping bacteria species from the simulation
 when their abundance reaches 0 or below on one round of simulation. In case of error
-each simulation returns "-1"
+each simulation returns "-1". Floating point errors are caught inside the Runge-Kutta steps
+with a local np.errstate, the global NumPy error state is not changed.
+
+Live species are kept as a boolean mask of length n, so the per capita rates of the whole
+community are found with a single matrix-vector product in stead of a loop over species.
+The fixed step simulations of a single community go further and compact the interaction
+matrix, growth rates and abundances to the surviving species after each extinction, so later
+steps cost O(k^2) for k survivors. Extinct species have abundance 0.
+
+The interaction matrix can be given as a numpy array or as a scipy.sparse matrix (for example
+CSR from add_sparcity with large communities). Sparse matrices stay sparse through the
+right-hand side and compaction. Steady state polishing and the Rosenbrock linear solves use
+GLV_steady_state_calculator.interactions_solver, which solves sparse systems iteratively with
+GMRES and only falls back to a dense factorization if GMRES doesn't converge.
+Stacks of interaction matrices in batch_gLV_RK have to be dense.
 
 find_change: A function that finds the magnitude of change for given starting abundances
-for a time increment. Used for calculating k1-k4 for the Runge-Kutta method
+for a time increment. Used for calculating k1-k4 for the Runge-Kutta method. Rates are
+calculated for all species at once and species outside the livespecies mask get zero change.
+
+find_livespecies: Returns the boolean mask of species present in the given starting abundances.
+
+RK_step: Calculates k1-k4 with find_change and returns the rounded fourth order Runge-Kutta
+change for one time increment, or "-1" in case of error.
+
+find_log_change: Change of log-abundances, d log N/dt = r + AN, for a time increment.
+
+log_RK_step: Fourth order Runge-Kutta change of log-abundances, or "-1" in case of error.
+
+compact_community: Returns the interaction matrix and growth rates of the given species only.
+
+locate_extinctions: Finishes a Runge-Kutta step of a compacted community. If abundances would
+drop to 0 or below during the step, the crossing time of the first extinction is located by
+linear interpolation, the community is advanced to it, the extinct species is removed and the
+rest of the step is simulated with the compacted community. Returns the new abundances,
+interactions, growth rates and indexes of the surviving species.
 
 add_steady_state_tail: Function adds steady state abundances from given timepoint in
 deterministic functions.
 
+Steady state: the deterministic fixed step functions declare steady state once the largest
+absolute change of a time increment has stayed below steady_atol + steady_rtol*max(abundances)
+and the largest per capita change of a time increment, max|r_i + (AN)_i|*time_increment over the
+surviving species, has stayed below steady_growth_tol for steady_window consecutive increments.
+The per capita check keeps rare species that are still dying out or growing (whose rounded
+change is below the absolute tolerance) from passing as steady. With polish=True the state of the surviving species
+is then replaced by the solution of their linear steady state system r + AN = 0 (a Newton step
+on the gLV fixed point), if that solution is positive and close to the simulated state.
+
+steady_change: Checks the steady state tolerance for one time increment.
+
+polish_steady_state: Returns the polished steady state of the given (compacted) community,
+or the given abundances if the linear solution is not acceptable.
+
+find_sampled_times: Returns the sorted time increments to be recorded, either the given
+sampled_times or every k-th increment. Times outside 0...max_increments are dropped, and if none
+of the given sampled_times are left a ValueError is raised.
+
 gLV_RK: function simulates generalized Lotka-Volterra dynamics with a fourth order
-Runge-Kutta method. Function is deterministic.
+Runge-Kutta method. Function is deterministic. If sampled_times (indexes of time increments)
+are given only those rows of the trajectory are returned.
+
+gLV_RK_stream: Generator version of gLV_RK that keeps only the current abundances in memory
+and yields (time increment, abundances) at the given sampled_times or every k-th increment.
+In case of error yields "-1" in stead of abundances and stops.
+
+stochastic_gLV_RK: Same as previous function, but adds a random term sqrt(N*sigma)*dW for each
+timepoint so that there's stochasticity in the changerate for the bacteria. Noise is drawn in
+blocks of block_size time increments from the numpy.random.Generator rng (or a seed for one).
+Without rng a Generator is seeded from the global NumPy random state, so scripts seeded with
+np.random.seed stay reproducible. The increments dW are Gaussian Wiener increments with variance
+time_increment by default (noise='wiener'), noise='uniform' gives uniform increments with the
+same variance and noise='uniform_difference' the difference of two uniform draws used in the
+old models.
+
+find_rng: Returns a numpy.random.Generator for the given Generator, seed or None.
 
-stochastic_gLV_RK: Same as previous function, but adds a random term for each timepoint
-so that there's stochasticity in the changerate for the bacteria.
+generate_noise: Draws an array of noise increments of the given distribution.
 
-leave_one_out_gLV_RK: Function takes a set of bacteria species and returns a set of
-leave-one-out experiments for the species set.
+noise_blocks: Generator of (block_size, n) blocks of noise increments covering max_increments.
+
+log_gLV_RK: Same as gLV_RK, but evolves the log-abundances log N, so abundances stay positive
+by construction and fast growing communities can be simulated with larger steps. A species
+goes extinct when its abundance falls below extinction_threshold, after which the community is
+compacted to the survivors. Changes are not rounded. If sampled_times are given only those
+rows of the trajectory are returned.
 
 gLV_RK_return_steady_state: Only returns the steady state of a deterministic generalized
 Lotka Volterra simulation, or the last simulated values if steady state hasn't been found.
 Also returns a variable that states if steady state was found.
+
+negative_definite_interactions: True if the symmetric part of the interaction matrix is negative definite.
+
+lcp_gLV_return_steady_state: Same inputs and outputs as gLV_RK_return_steady_state, but the steady
+state of the species present in starting_abundances is first solved as a linear complementarity
+problem with GLV_steady_state_calculator.saturated_steady_state_glv. This is only done when the
+symmetric part (A+A^T)/2 of the interactions between the present species is negative definite, in
+which case the saturated steady state is unique and globally stable, so it is the one reached from
+any starting abundances. If the result is stable and uninvadable it is returned without any time
+integration. Otherwise (also when the symmetric part isn't negative definite and the community could
+have several stable states) the community is simulated with gLV_RK_return_steady_state.
+
+batch_growth: Per capita growth rates ri + AN of a stack of communities, interactions and ri as
+in batch_find_change.
+
+batch_find_change: Same as find_change, but for a stack of communities. Abundances and
+livespecies are (B, n) arrays, interactions either one (n, n) matrix shared by all members
+or a (B, n, n) stack, ri either a single vector or a (B, n) stack.
+
+batch_RK_step: Fourth order Runge-Kutta change for a stack of communities.
+
+batch_gLV_RK: Simulates B communities together as one (B, n) array, for example the
+leave-one-out starting abundances from generate_loo_starting_abundances. Each member keeps
+its own extinction mask and steady state flag, and members that reach steady state or fail
+are dropped from the active set. Members where a species crosses zero during a step are
+stepped with locate_extinctions as in gLV_RK, so each member follows the same scheme as a
+gLV_RK run of it. Steady state is checked for each member with the same
+tolerances as in gLV_RK. Returns the (B, samples, n) trajectories, by default all
+max_increments+1 time increments or only the given sampled_times, and a status vector with
+1 for steady state found, 0 for maxtime reached and -1 for error.
+
+gLV_RK45: Adaptive step alternative to gLV_RK with the embedded Dormand-Prince 5(4) pair.
+The step size is controlled by the embedded error estimate with relative and absolute
+tolerances rtol and atol, and values are given on the fixed time_increment grid (same shape as
+gLV_RK output) or at the given output_times with the dense output interpolant, so near
+equilibrium the solver takes long steps without losing resolution of the returned trajectory.
+Overflow and invalid operations return "-1", underflow of species decaying towards extinction
+is not an error.
+
+gLV_jacobian: Analytic Jacobian of the gLV right-hand side, diag(N)A + diag(r + AN), with rows
+of species outside the livespecies mask set to zero.
+
+gLV_rosenbrock: Stiff alternative to gLV_RK with the same call signature and outputs as gLV_RK45.
+Uses the linearly implicit second order Rosenbrock method of Shampine and Reichelt (ode23s)
+with the analytic Jacobian and an embedded third order error estimate, so communities where
+self-limitation of some species is much faster than the dynamics of others can be simulated
+without shrinking the step for the whole community. As in gLV_RK45 underflow is not an error.
 '''
 
 def find_change(n, abundances, interactions, ri, livespecies, time_increment):
-        return_change = np.zeros(n)
-        i = 0
-        while i < len(livespecies):
-            try:
-                change_per_capita = (ri[livespecies[i]] + sum(abundances*interactions[livespecies[i]]))*time_increment
-                change = abundances[livespecies[i]]*change_per_capita
-            except:
-                return -1
-            return_change[livespecies[i]] = change
-            i+=1
-        return return_change
+    try:
+        change = abundances*(ri + interactions@abundances)*time_increment
+    except FloatingPointError:
+        return -1
+    return np.where(livespecies, change, 0.0)
+
+def find_log_change(log_abundances, interactions, ri, time_increment):
+    try:
+        return (ri + interactions@np.exp(log_abundances))*time_increment
+    except FloatingPointError:
+        return -1
+
+def log_RK_step(log_abundances, interactions, ri, time_increment):
+    with np.errstate(over='raise', invalid='raise', divide='raise'):
+        k1 = find_log_change(log_abundances, interactions, ri, time_increment)
+        if type(k1) == int:
+            return -1
+        k2 = find_log_change(log_abundances+(k1/2), interactions, ri, time_increment)
+        if type(k2) == int:
+            return -1
+        k3 = find_log_change(log_abundances+(k2/2), interactions, ri, time_increment)
+        if type(k3) == int:
+            return -1
+        k4 = find_log_change(log_abundances+k3, interactions, ri, time_increment)
+        if type(k4) == int:
+            return -1
+        return (1/6)*(k1+2*k2+2*k3+k4)
+
+def find_livespecies(starting_abundances):
+    return np.asarray(starting_abundances) != 0
+
+def RK_step(n, abundances, interactions, ri, livespecies, time_increment):
+    with np.errstate(all='raise'):
+        k1 = find_change(n, abundances, interactions, ri, livespecies, time_increment)
+        if type(k1) == int:
+            return -1
+        k2 = find_change(n, abundances+(k1/2), interactions, ri, livespecies, time_increment)
+        if type(k2) == int:
+            return -1
+        k3 = find_change(n, abundances+(k2/2), interactions, ri, livespecies, time_increment)
+        if type(k3) == int:
+            return -1
+        k4 = find_change(n, abundances+k3, interactions, ri, livespecies, time_increment)
+        if type(k4) == int:
+            return -1
+        return np.around((1/6)*(k1+2*k2+2*k3+k4), decimals=6)
+
+DP_C = np.array([0, 1/5, 3/10, 4/5, 8/9, 1])
+DP_A = np.array([
+    [0, 0, 0, 0, 0],
+    [1/5, 0, 0, 0, 0],
+    [3/40, 9/40, 0, 0, 0],
+    [44/45, -56/15, 32/9, 0, 0],
+    [19372/6561, -25360/2187, 64448/6561, -212/729, 0],
+    [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656]])
+DP_B = np.array([35/384, 0, 500/1113, 125/192, -2187/6784, 11/84])
+DP_E = np.array([-71/57600, 0, 71/16695, -71/1920, 17253/339200, -22/525, 1/40])
+DP_P = np.array([
+    [1, -8048581381/2820520608, 8663915743/2820520608, -12715105075/11282082432],
+    [0, 0, 0, 0],
+    [0, 131558114200/32700410799, -68118460800/10900136933, 87487479700/32700410799],
+    [0, -1754552775/470086768, 14199869525/1410260304, -10690763975/1880347072],
+    [0, 127303824393/49829197408, -318862633887/49829197408, 701980252875/199316789632],
+    [0, -282668133/205662961, 2019193451/616988883, -1453857185/822651844],
+    [0, 40617522/29380423, -110615467/29380423, 69997945/29380423]])
+
+ROS_D = 1/(2+np.sqrt(2))
+ROS_E32 = 6+np.sqrt(2)
+
+def steady_change(change, abundances, steady_rtol, steady_atol, interactions, ri, time_increment, steady_growth_tol):
+    if np.max(np.abs(change), initial=0) > steady_atol+steady_rtol*np.max(np.abs(abundances), initial=0):
+        return False
+    # Rare species pass the absolute tolerance whatever their growth, so their per capita change is checked too
+    return np.max(np.abs(ri+interactions@abundances), initial=0)*time_increment <= steady_growth_tol
+
+def polish_steady_state(abundances, interactions, ri, polish_tolerance=1e-3):
+    if len(abundances) == 0:
+        return abundances
+    try:
+        polished = solve_interactions(interactions, -ri)
+    except (np.linalg.LinAlgError, RuntimeError):
+        return abundances
+    if np.all(polished > 0) and np.max(np.abs(polished-abundances)) <= polish_tolerance*np.max(abundances):
+        return polished
+    return abundances
+
+def find_sampled_times(max_increments, sampled_times=None, every=1):
+    if sampled_times is None:
+        return np.arange(0, max_increments+1, every)
+    sampled_times = np.unique(np.asarray(sampled_times, dtype=int))
+    sampled_times = sampled_times[(sampled_times >= 0) & (sampled_times <= max_increments)]
+    if len(sampled_times) == 0:
+        raise ValueError(f"No sampled_times between 0 and {max_increments} (maxtime/time_increment)")
+    return sampled_times
 
 def add_steady_state_tail(abundances, time, max_increments):
     steady_abundances = np.repeat(np.array([abundances[time]]), max_increments-time, axis=0)
     abundances[time+1:] = steady_abundances
     return abundances
 
-def gLV_RK(n, maxtime, time_increment, interactions, ri, starting_abundances):
-    np.seterr(all='raise')
+def compact_community(interactions, ri, species):
+    return interactions[species][:, species], ri[species]
+
+def locate_extinctions(state, change, interactions, ri, species, time_increment):
+    remaining = time_increment
+    new_state = state+change
+    while np.any(new_state <= 0):
+        extinct = new_state <= 0
+        fractions = np.full(len(state), np.inf)
+        fractions[extinct] = state[extinct]/(state[extinct]-new_state[extinct])
+        first = np.argmin(fractions)
+        crossing = fractions[first]*remaining
+        partial = RK_step(len(state), state, interactions, ri, True, crossing)
+        if type(partial) == int:
+            return -1
+        state = state+partial
+        surviving = state > 0
+        surviving[first] = False
+        surviving = np.flatnonzero(surviving)
+        interactions, ri = compact_community(interactions, ri, surviving)
+        species = species[surviving]
+        state = state[surviving]
+        remaining -= crossing
+        change = RK_step(len(state), state, interactions, ri, True, remaining)
+        if type(change) == int:
+            return -1
+        new_state = state+change
+    return new_state, interactions, ri, species
+
+def gLV_RK(n, maxtime, time_increment, interactions, ri, starting_abundances, sampled_times=None, steady_rtol=1e-9, steady_atol=1e-6, steady_window=10, polish=False, steady_growth_tol=1e-6):
+    if sampled_times is not None:
+        samples = list(gLV_RK_stream(n, maxtime, time_increment, interactions, ri, starting_abundances, sampled_times, 1, steady_rtol, steady_atol, steady_window, polish, steady_growth_tol))
+        if len(samples) > 0 and type(samples[-1][1]) == int:
+            return -1
+        return np.array([sample for time, sample in samples])
     max_increments = int(maxtime*(1/time_increment))
     abundances = np.zeros((max_increments+1, n))
     abundances[0] = starting_abundances
     time = 1
-    livespecies = list(range(0,n))
-    if sum(starting_abundances==0)>0:
-        i = 0
-        while i < len(livespecies):
-            if starting_abundances[livespecies[i]] == 0:
-                del livespecies[i]
-            i +=1
-    steady = False
+    species = np.flatnonzero(find_livespecies(starting_abundances))
+    active_interactions, active_ri = compact_community(interactions, np.asarray(ri), species)
+    state = abundances[0, species]
+    calm = 0
     while time < max_increments+1:
-        k1 = find_change(n, abundances[time-1], interactions, ri, livespecies, time_increment)
-        if type(k1) == int:
-            return -1
-        k2 = find_change(n, abundances[time-1]+(k1/2), interactions, ri, livespecies, time_increment)
-        if type(k2) == int:
-            return -1
-        k3 = find_change(n, abundances[time-1]+(k2/2), interactions, ri, livespecies, time_increment)
-        if type(k3) == int:
+        change = RK_step(len(species), state, active_interactions, active_ri, True, time_increment)
+        if type(change) == int:
             return -1
-        k4 = find_change(n, abundances[time-1]+k3, interactions, ri, livespecies, time_increment)
-        if type(k4) == int:
+        stepped = locate_extinctions(state, change, active_interactions, active_ri, species, time_increment)
+        if type(stepped) == int:
             return -1
-        change = np.around((1/6)*(k1+2*k2+2*k3+k4), decimals=6)
-        if sum(change) == 0:
-            steady = True
-            break
-        abundances[time] = abundances[time-1]+change
-        i = 0
-        while i < len(livespecies):
-            if abundances[time][livespecies[i]] <= 0:
-                abundances[time][livespecies[i]] == 0
-                del livespecies[i]
-            i +=1
+        state, active_interactions, active_ri, species = stepped
+        if steady_change(change, state, steady_rtol, steady_atol, active_interactions, active_ri, time_increment, steady_growth_tol):
+            calm += 1
+        else:
+            calm = 0
+        if calm >= steady_window:
+            if polish:
+                state = polish_steady_state(state, active_interactions, active_ri)
+            abundances[time, species] = state
+            return add_steady_state_tail(abundances, time, max_increments)
+        abundances[time, species] = state
         time += 1
-    if steady and time < max_increments:
-        return add_steady_state_tail(abundances, time, max_increments)
     return abundances
 
-def stochastic_gLV_RK(n, maxtime, time_increment, interactions, ri, starting_abundances, sigma):
-    np.seterr(all='raise')
+def gLV_RK_stream(n, maxtime, time_increment, interactions, ri, starting_abundances, sampled_times=None, every=1, steady_rtol=1e-9, steady_atol=1e-6, steady_window=10, polish=False, steady_growth_tol=1e-6):
+    max_increments = int(maxtime*(1/time_increment))
+    sampled_times = find_sampled_times(max_increments, sampled_times, every)
+    next_sample = 0
+    abundances = np.array(starting_abundances, dtype=float)
+    species = np.flatnonzero(find_livespecies(abundances))
+    active_interactions, active_ri = compact_community(interactions, np.asarray(ri), species)
+    state = abundances[species]
+    if sampled_times[0] == 0:
+        yield 0, abundances.copy()
+        next_sample += 1
+    time = 1
+    calm = 0
+    while time < max_increments+1 and next_sample < len(sampled_times):
+        change = RK_step(len(species), state, active_interactions, active_ri, True, time_increment)
+        if type(change) == int:
+            yield time, -1
+            return
+        stepped = locate_extinctions(state, change, active_interactions, active_ri, species, time_increment)
+        if type(stepped) == int:
+            yield time, -1
+            return
+        state, active_interactions, active_ri, species = stepped
+        if steady_change(change, state, steady_rtol, steady_atol, active_interactions, active_ri, time_increment, steady_growth_tol):
+            calm += 1
+        else:
+            calm = 0
+        if calm >= steady_window and polish:
+            state = polish_steady_state(state, active_interactions, active_ri)
+        abundances[:] = 0
+        abundances[species] = state
+        if calm >= steady_window:
+            for sample_time in sampled_times[next_sample:]:
+                yield sample_time, abundances.copy()
+            return
+        if sampled_times[next_sample] == time:
+            yield time, abundances.copy()
+            next_sample += 1
+        time += 1
+
+def find_rng(rng=None):
+    if rng is None:
+        return np.random.default_rng(np.random.randint(0, 2**31))
+    if isinstance(rng, np.random.Generator):
+        return rng
+    return np.random.default_rng(rng)
+
+def generate_noise(rng, noise, size, time_increment):
+    if noise == 'wiener':
+        return rng.standard_normal(size)*np.sqrt(time_increment)
+    if noise == 'uniform':
+        return rng.uniform(-1, 1, size)*np.sqrt(3*time_increment)
+    if noise == 'uniform_difference':
+        return rng.random(size)-rng.random(size)
+    raise ValueError(f"Unknown noise distribution {noise}")
+
+def noise_blocks(rng, noise, n, max_increments, time_increment, block_size=1000):
+    drawn = 0
+    while drawn < max_increments:
+        rows = min(block_size, max_increments-drawn)
+        yield generate_noise(rng, noise, (rows, n), time_increment)
+        drawn += rows
+
+def stochastic_gLV_RK(n, maxtime, time_increment, interactions, ri, starting_abundances, sigma, rng=None, noise='wiener', block_size=1000):
     max_increments = int(maxtime*(1/time_increment))
     abundances = np.zeros((max_increments+1, n))
     abundances[0] = starting_abundances
+    sigma = np.asarray(sigma)
+    blocks = noise_blocks(find_rng(rng), noise, n, max_increments, time_increment, block_size)
+    block = np.zeros((0, n))
+    row = 0
     time = 1
-    livespecies = list(range(0,n))
-    if sum(starting_abundances==0)>0:
-        i = 0
-        while i < len(livespecies):
-            if starting_abundances[livespecies[i]] == 0:
-                del livespecies[i]
-            i +=1
+    species = np.flatnonzero(find_livespecies(starting_abundances))
+    active_interactions, active_ri = compact_community(interactions, np.asarray(ri), species)
+    state = abundances[0, species]
     while time < max_increments+1:
-        k1 = find_change(n, abundances[time-1], interactions, ri, livespecies, time_increment)
-        if type(k1) == int:
-            return -1
-        k2 = find_change(n, abundances[time-1]+(k1/2), interactions, ri, livespecies, time_increment)
-        if type(k2) == int:
-            return -1
-        k3 = find_change(n, abundances[time-1]+(k2/2), interactions, ri, livespecies, time_increment)
-        if type(k3) == int:
+        change = RK_step(len(species), state, active_interactions, active_ri, True, time_increment)
+        if type(change) == int:
             return -1
-        k4 = find_change(n, abundances[time-1]+k3, interactions, ri, livespecies, time_increment)
-        if type(k4) == int:
+        if row == len(block):
+            block = next(blocks)
+            row = 0
+        dW = block[row, species]
+        row += 1
+        state = state+change+np.sqrt(state*sigma[species])*dW
+        surviving = np.flatnonzero(state > 0)
+        if len(surviving) < len(species):
+            active_interactions, active_ri = compact_community(active_interactions, active_ri, surviving)
+            species = species[surviving]
+            state = state[surviving]
+        abundances[time, species] = state
+        time += 1
+    return abundances
+
+def log_gLV_RK(n, maxtime, time_increment, interactions, ri, starting_abundances, extinction_threshold=1e-6, sampled_times=None, steady_rtol=1e-9, steady_atol=1e-6, steady_window=10, steady_growth_tol=1e-6):
+    max_increments = int(maxtime*(1/time_increment))
+    sampled_times = find_sampled_times(max_increments, sampled_times)
+    abundances = np.zeros((len(sampled_times), n))
+    starting_abundances = np.array(starting_abundances, dtype=float)
+    if sampled_times[0] == 0:
+        abundances[0] = starting_abundances
+    next_sample = np.searchsorted(sampled_times, 1)
+    species = np.flatnonzero(starting_abundances > extinction_threshold)
+    active_interactions, active_ri = compact_community(interactions, np.asarray(ri), species)
+    log_state = np.log(starting_abundances[species])
+    state = starting_abundances[species]
+    log_threshold = np.log(extinction_threshold)
+    time = 1
+    calm = 0
+    while time < max_increments+1 and next_sample < len(sampled_times):
+        change = log_RK_step(log_state, active_interactions, active_ri, time_increment)
+        if type(change) == int:
             return -1
-        change = np.around((1/6)*(k1+2*k2+2*k3+k4), decimals=6)
-        stochasticity = np.zeros(n)
-        i = 0
-        while i < len(livespecies):
-            dW = np.random.random() - np.random.random()
-            stochasticity[livespecies[i]] = np.sqrt(abundances[time-1][livespecies[i]]*sigma[livespecies[i]])*dW
-            i += 1
-        abundances[time] = abundances[time-1]+change+stochasticity
-        i = 0
-        while i < len(livespecies):
-            if abundances[time][livespecies[i]] <= 0:
-                abundances[time][livespecies[i]] == 0
-                del livespecies[i]
-            i +=1
+        log_state = log_state+change
+        new_state = np.exp(log_state)
+        if steady_change(new_state-state, new_state, steady_rtol, steady_atol, active_interactions, active_ri, time_increment, steady_growth_tol):
+            calm += 1
+        else:
+            calm = 0
+        state = new_state
+        surviving = np.flatnonzero(log_state > log_threshold)
+        if len(surviving) < len(species):
+            active_interactions, active_ri = compact_community(active_interactions, active_ri, surviving)
+            species = species[surviving]
+            log_state = log_state[surviving]
+            state = state[surviving]
+        if calm >= steady_window:
+            abundances[next_sample:, species] = state
+            return abundances
+        if sampled_times[next_sample] == time:
+            abundances[next_sample, species] = state
+            next_sample += 1
         time += 1
     return abundances
 
-def gLV_RK_return_steady_state(n, maxtime, time_increment, interactions, ri, starting_abundances):
-    np.seterr(all='raise')
+def gLV_RK_return_steady_state(n, maxtime, time_increment, interactions, ri, starting_abundances, steady_rtol=1e-9, steady_atol=1e-6, steady_window=10, polish=False, steady_growth_tol=1e-6):
     max_increments = int(maxtime*(1/time_increment))
-    abundances = np.zeros((2, n))
-    abundances[0] = starting_abundances
-    index = 0
     time = 1
-    livespecies = list(range(0,n))
-    if sum(starting_abundances==0)>0:
-        i = 0
-        while i < len(livespecies):
-            if starting_abundances[livespecies[i]] == 0:
-                del livespecies[i]
-            i +=1
+    species = np.flatnonzero(find_livespecies(starting_abundances))
+    active_interactions, active_ri = compact_community(interactions, np.asarray(ri), species)
+    state = np.array(starting_abundances, dtype=float)[species]
     steady = False
+    calm = 0
     while time < max_increments+1:
-        k1 = find_change(n, abundances[index], interactions, ri, livespecies, time_increment)
-        if type(k1) == int:
-            return -1
-        k2 = find_change(n, abundances[index]+(k1/2), interactions, ri, livespecies, time_increment)
-        if type(k2) == int:
+        change = RK_step(len(species), state, active_interactions, active_ri, True, time_increment)
+        if type(change) == int:
             return -1
-        k3 = find_change(n, abundances[index]+(k2/2), interactions, ri, livespecies, time_increment)
-        if type(k3) == int:
-            return -1
-        k4 = find_change(n, abundances[index]+k3, interactions, ri, livespecies, time_increment)
-        if type(k4) == int:
+        stepped = locate_extinctions(state, change, active_interactions, active_ri, species, time_increment)
+        if type(stepped) == int:
             return -1
-        change = np.around((1/6)*(k1+2*k2+2*k3+k4), decimals=6)
-        if sum(change) == 0:
+        state, active_interactions, active_ri, species = stepped
+        if steady_change(change, state, steady_rtol, steady_atol, active_interactions, active_ri, time_increment, steady_growth_tol):
+            calm += 1
+        else:
+            calm = 0
+        if calm >= steady_window:
             steady = True
+            if polish:
+                state = polish_steady_state(state, active_interactions, active_ri)
             break
-        abundances[abs(index-1)] = abundances[index]+change
-        i = 0
-        while i < len(livespecies):
-            if abundances[time][livespecies[i]] <= 0:
-                abundances[time][livespecies[i]] == 0
-                del livespecies[i]
-            i +=1
-        if steady:
-            break
-        else:
-            index = abs(index-1)
+        time += 1
+    abundances = np.zeros(n)
+    abundances[species] = state
+    return steady, abundances
+
+def negative_definite_interactions(interactions):
+    if issparse(interactions):
+        interactions = interactions.toarray()
+    return len(interactions) == 0 or np.max(np.linalg.eigvalsh((interactions+np.transpose(interactions))/2)) < 0
+
+def lcp_gLV_return_steady_state(n, maxtime, time_increment, interactions, ri, starting_abundances, steady_rtol=1e-9, steady_atol=1e-6, steady_window=10, polish=False, steady_growth_tol=1e-6):
+    species = np.flatnonzero(find_livespecies(starting_abundances))
+    active_interactions, active_ri = compact_community(interactions, np.asarray(ri), species)
+    # Without a negative definite symmetric part there can be several stable states, so the simulation decides
+    if not negative_definite_interactions(active_interactions):
+        return gLV_RK_return_steady_state(n, maxtime, time_increment, interactions, ri, starting_abundances, steady_rtol, steady_atol, steady_window, polish, steady_growth_tol)
+    saturated = saturated_steady_state_glv(len(species), active_ri, active_interactions)
+    if type(saturated) != int and check_saturated_steady_state_stable(len(species), active_ri, active_interactions, saturated):
+        abundances = np.zeros(n)
+        abundances[species] = saturated
+        return True, abundances
+    return gLV_RK_return_steady_state(n, maxtime, time_increment, interactions, ri, starting_abundances, steady_rtol, steady_atol, steady_window, polish, steady_growth_tol)
+
+def batch_growth(abundances, interactions, ri):
+    if np.ndim(interactions) == 2:
+        rates = np.transpose(interactions@np.transpose(abundances))
+    else:
+        rates = np.einsum('bij,bj->bi', interactions, abundances)
+    return ri + rates
+
+def batch_find_change(abundances, interactions, ri, livespecies, time_increment):
+    change = abundances*batch_growth(abundances, interactions, ri)*time_increment
+    return np.where(livespecies, change, 0.0)
+
+def batch_RK_step(abundances, interactions, ri, livespecies, time_increment):
+    k1 = batch_find_change(abundances, interactions, ri, livespecies, time_increment)
+    k2 = batch_find_change(abundances+(k1/2), interactions, ri, livespecies, time_increment)
+    k3 = batch_find_change(abundances+(k2/2), interactions, ri, livespecies, time_increment)
+    k4 = batch_find_change(abundances+k3, interactions, ri, livespecies, time_increment)
+    return np.around((1/6)*(k1+2*k2+2*k3+k4), decimals=6)
+
+def batch_gLV_RK(n, maxtime, time_increment, interactions, ri, starting_abundances, sampled_times=None, steady_rtol=1e-9, steady_atol=1e-6, steady_window=10, polish=False, steady_growth_tol=1e-6):
+    starting_abundances = np.atleast_2d(starting_abundances)
+    members = len(starting_abundances)
+    max_increments = int(maxtime*(1/time_increment))
+    sampled_times = find_sampled_times(max_increments, sampled_times)
+    abundances = np.zeros((members, len(sampled_times), n))
+    state = np.array(starting_abundances, dtype=float)
+    if sampled_times[0] == 0:
+        abundances[:, 0] = state
+    next_sample = np.searchsorted(sampled_times, 1)
+    status = np.zeros(members, dtype=int)
+    active = np.arange(members)
+    livespecies = find_livespecies(starting_abundances)
+    calm = np.zeros(members, dtype=int)
+    if not issparse(interactions):
+        interactions = np.asarray(interactions)
+    ri = np.asarray(ri)
+    active_interactions = interactions
+    active_ri = ri
+    time = 1
+    with np.errstate(all='ignore'):
+        while time < max_increments+1 and len(active) > 0:
+            change = batch_RK_step(state, active_interactions, active_ri, livespecies, time_increment)
+            failed = ~np.all(np.isfinite(change), axis=1)
+            new_state = state+change
+            crossing = ~failed & np.any(livespecies & (new_state <= 0), axis=1)
+            for i in np.flatnonzero(crossing):
+                member_interactions = active_interactions[i] if np.ndim(active_interactions) == 3 else active_interactions
+                member_ri = active_ri[i] if np.ndim(active_ri) == 2 else active_ri
+                alive = np.flatnonzero(livespecies[i])
+                stepped = locate_extinctions(state[i, alive], change[i, alive], *compact_community(member_interactions, member_ri, alive), alive, time_increment)
+                if type(stepped) == int:
+                    failed[i] = True
+                    continue
+                new_state[i] = 0
+                new_state[i, stepped[3]] = stepped[0]
+            state = new_state
+            livespecies &= state > 0
+            state[~livespecies] = 0
+            tolerance = steady_atol+steady_rtol*np.max(np.abs(state), axis=1)
+            calm_step = np.max(np.abs(change), axis=1) <= tolerance
+            if np.any(calm_step):
+                growth = np.where(livespecies, np.abs(batch_growth(state, active_interactions, active_ri)), 0)
+                calm_step &= np.max(growth, axis=1)*time_increment <= steady_growth_tol
+            calm = np.where(calm_step, calm+1, 0)
+            steady = ~failed & (calm >= steady_window)
+            running = ~(failed | steady)
+            if polish:
+                for i in np.flatnonzero(steady):
+                    member_interactions = active_interactions[i] if np.ndim(active_interactions) == 3 else active_interactions
+                    member_ri = active_ri[i] if np.ndim(active_ri) == 2 else active_ri
+                    alive = np.flatnonzero(livespecies[i])
+                    state[i, alive] = polish_steady_state(state[i, alive], *compact_community(member_interactions, member_ri, alive))
+            if next_sample < len(sampled_times) and sampled_times[next_sample] == time:
+                abundances[active[~failed], next_sample] = state[~failed]
+                next_sample += 1
+            for i in np.flatnonzero(steady):
+                abundances[active[i], next_sample:] = state[i]
+            status[active[steady]] = 1
+            status[active[failed]] = -1
+            if not np.all(running):
+                active = active[running]
+                state = state[running]
+                livespecies = livespecies[running]
+                calm = calm[running]
+                if np.ndim(interactions) == 3:
+                    active_interactions = interactions[active]
+                if np.ndim(ri) == 2:
+                    active_ri = ri[active]
             time += 1
-    return steady, abundances[index]
+    return abundances, status
+
+def gLV_RK45(n, maxtime, time_increment, interactions, ri, starting_abundances, rtol=1e-6, atol=1e-6, output_times=None):
+    if output_times is None:
+        max_increments = int(maxtime*(1/time_increment))
+        output_times = np.arange(max_increments+1)*time_increment
+    output_times = np.asarray(output_times, dtype=float)
+    abundances = np.zeros((len(output_times), n))
+    state = np.array(starting_abundances, dtype=float)
+    livespecies = find_livespecies(state)
+    abundances[output_times <= 0] = state
+    next_output = np.sum(output_times <= 0)
+    t = 0.0
+    step = time_increment
+    stages = np.zeros((7, n))
+    with np.errstate(all='raise', under='ignore'):
+        try:
+            change = find_change(n, state, interactions, ri, livespecies, 1.0)
+            if type(change) == int:
+                return -1
+            stages[0] = change
+            while next_output < len(output_times):
+                step = min(step, maxtime-t)
+                for i in range(1, 6):
+                    change = find_change(n, state+step*(DP_A[i, :i]@stages[:i]), interactions, ri, livespecies, 1.0)
+                    if type(change) == int:
+                        return -1
+                    stages[i] = change
+                new_state = state+step*(DP_B@stages[:6])
+                change = find_change(n, new_state, interactions, ri, livespecies, 1.0)
+                if type(change) == int:
+                    return -1
+                stages[6] = change
+                scale = atol+rtol*np.maximum(np.abs(state), np.abs(new_state))
+                error = np.sqrt(np.mean((step*(DP_E@stages)/scale)**2))
+                if error > 1:
+                    step = step*max(0.2, 0.9*error**(-1/5))
+                    continue
+                reached = output_times[next_output:] <= t+step
+                if t+step >= maxtime:
+                    reached[:] = True
+                if np.any(reached):
+                    theta = (output_times[next_output:][reached]-t)/step
+                    powers = np.cumprod(np.repeat(theta[:, None], 4, axis=1), axis=1)
+                    dense = state+step*(powers@(np.transpose(DP_P)@stages))
+                    dead = livespecies & (new_state <= 0)
+                    dense[:, dead] = np.maximum(dense[:, dead], 0)
+                    abundances[next_output:next_output+len(theta)] = dense
+                    next_output += len(theta)
+                extinct = livespecies & (new_state <= 0)
+                livespecies &= new_state > 0
+                new_state[~livespecies & (new_state < 0)] = 0
+                state = new_state
+                t += step
+                # First same as last: the last stage is the first stage of the next step, unless species went extinct
+                if np.any(extinct):
+                    change = find_change(n, state, interactions, ri, livespecies, 1.0)
+                    if type(change) == int:
+                        return -1
+                    stages[0] = change
+                else:
+                    stages[0] = stages[6]
+                if error == 0:
+                    step = step*10
+                else:
+                    step = step*min(10, 0.9*error**(-1/5))
+        except FloatingPointError:
+            return -1
+    return abundances
+
+def gLV_jacobian(abundances, interactions, ri, livespecies):
+    if issparse(interactions):
+        jacobian = diags(abundances)@interactions+diags(ri+interactions@abundances)
+        return csc_matrix(diags(livespecies.astype(float))@jacobian)
+    jacobian = abundances[:, None]*interactions
+    jacobian[np.diag_indices_from(jacobian)] += ri + interactions@abundances
+    jacobian[~livespecies] = 0
+    return jacobian
+
+def gLV_rosenbrock(n, maxtime, time_increment, interactions, ri, starting_abundances, rtol=1e-6, atol=1e-6, output_times=None):
+    if output_times is None:
+        max_increments = int(maxtime*(1/time_increment))
+        output_times = np.arange(max_increments+1)*time_increment
+    output_times = np.asarray(output_times, dtype=float)
+    abundances = np.zeros((len(output_times), n))
+    state = np.array(starting_abundances, dtype=float)
+    livespecies = find_livespecies(state)
+    abundances[output_times <= 0] = state
+    next_output = np.sum(output_times <= 0)
+    t = 0.0
+    step = time_increment
+    with np.errstate(all='raise', under='ignore'):
+        try:
+            F0 = find_change(n, state, interactions, ri, livespecies, 1.0)
+            if type(F0) == int:
+                return -1
+            jacobian = gLV_jacobian(state, interactions, ri, livespecies)
+            while next_output < len(output_times):
+                step = min(step, maxtime-t)
+                if issparse(jacobian):
+                    solve = interactions_solver(identity(n, format='csr')-step*ROS_D*jacobian)
+                else:
+                    W = lu_factor(np.eye(n)-step*ROS_D*jacobian)
+                    solve = lambda rhs: lu_solve(W, rhs)
+                k1 = solve(F0)
+                F1 = find_change(n, state+0.5*step*k1, interactions, ri, livespecies, 1.0)
+                if type(F1) == int:
+                    return -1
+                k2 = solve(F1-k1)+k1
+                new_state = state+step*k2
+                F2 = find_change(n, new_state, interactions, ri, livespecies, 1.0)
+                if type(F2) == int:
+                    return -1
+                k3 = solve(F2-ROS_E32*(k2-F1)-2*(k1-F0))
+                scale = atol+rtol*np.maximum(np.abs(state), np.abs(new_state))
+                error = np.sqrt(np.mean((step/6*(k1-2*k2+k3)/scale)**2))
+                if error > 1:
+                    step = step*max(0.2, 0.9*error**(-1/3))
+                    continue
+                reached = output_times[next_output:] <= t+step
+                if t+step >= maxtime:
+                    reached[:] = True
+                if np.any(reached):
+                    theta = (output_times[next_output:][reached]-t)/step
+                    dense = state+step*(np.outer(theta*(1-theta)/(1-2*ROS_D), k1)+np.outer(theta*(theta-2*ROS_D)/(1-2*ROS_D), k2))
+                    dead = livespecies & (new_state <= 0)
+                    dense[:, dead] = np.maximum(dense[:, dead], 0)
+                    abundances[next_output:next_output+len(theta)] = dense
+                    next_output += len(theta)
+                livespecies &= new_state > 0
+                new_state[~livespecies & (new_state < 0)] = 0
+                state = new_state
+                t += step
+                F0 = find_change(n, state, interactions, ri, livespecies, 1.0)
+                if type(F0) == int:
+                    return -1
+                jacobian = gLV_jacobian(state, interactions, ri, livespecies)
+                if error == 0:
+                    step = step*10
+                else:
+                    step = step*min(10, 0.9*error**(-1/3))
+        except (FloatingPointError, np.linalg.LinAlgError, ValueError, RuntimeError):
+            return -1
+    return abundances
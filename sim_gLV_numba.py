@@ -0,0 +1,194 @@
+import numpy as np
+from scipy.sparse import issparse
+from sim_gLV_RK import gLV_RK, stochastic_gLV_RK, find_rng, noise_blocks
+
+try:
+    from numba import njit
+    numba_available = True
+except ImportError:
+    numba_available = False
+
+''' Optional Numba compiled versions of the fixed step Runge-Kutta simulations in sim_gLV_RK.
+The whole integration loop, including compaction of the community after extinctions, event
+location of extinctions and the steady state monitor, is compiled to native code, so the
+per call overhead of NumPy does not dominate simulations of small communities (n of 10-25)
+run millions of times. The kernels follow sim_gLV_RK operation by operation and give the
+same trajectories for the same inputs. If Numba is not installed the functions fall back to
+the pure NumPy versions in sim_gLV_RK. Sparse interaction matrices always use the NumPy path.
+
+Floating point errors can't be trapped in compiled code, so the kernels return "-1" when
+abundances become non-finite in stead of when NumPy would raise.
+
+jit: Compiles the given function with numba.njit if Numba is available.
+
+kernel_RK_step: Fourth order Runge-Kutta change of a compacted community, rounded as in
+sim_gLV_RK.RK_step.
+
+kernel_compact_community: Compiled sim_gLV_RK.compact_community.
+
+kernel_locate_extinctions: Compiled sim_gLV_RK.locate_extinctions. Returns also a flag that
+is False in case of error.
+
+kernel_polish_steady_state: Compiled sim_gLV_RK.polish_steady_state.
+
+gLV_RK_kernel: Simulation loop of gLV_RK. Fills the given trajectory array, whose first row
+holds the starting abundances, and returns 1 for steady state, 0 for maxtime and -1 for error.
+
+stochastic_gLV_RK_kernel: Simulation loop of stochastic_gLV_RK for one block of noise increments,
+drawn with the same blocks as in stochastic_gLV_RK, starting from the row before start of the
+trajectory (the community is compacted again from the nonzero abundances of that row). Only one
+block of noise is in memory at a time.
+
+numba_gLV_RK: Same inputs and outputs as sim_gLV_RK.gLV_RK without sampled_times.
+
+numba_stochastic_gLV_RK: Same inputs and outputs as sim_gLV_RK.stochastic_gLV_RK, gives the same
+trajectory for the same rng.
+'''
+
+def jit(function):
+    if numba_available:
+        return njit(cache=True)(function)
+    return function
+
+@jit
+def kernel_find_change(state, interactions, ri, time_increment):
+    if len(state) == 0:
+        return state.copy()
+    return state*(ri+interactions@state)*time_increment
+
+@jit
+def kernel_RK_step(state, interactions, ri, time_increment):
+    k1 = kernel_find_change(state, interactions, ri, time_increment)
+    k2 = kernel_find_change(state+(k1/2), interactions, ri, time_increment)
+    k3 = kernel_find_change(state+(k2/2), interactions, ri, time_increment)
+    k4 = kernel_find_change(state+k3, interactions, ri, time_increment)
+    return np.around((1/6)*(k1+2*k2+2*k3+k4), 6)
+
+@jit
+def kernel_compact_community(interactions, ri, species):
+    return np.ascontiguousarray(interactions[species][:, species]), ri[species]
+
+@jit
+def kernel_locate_extinctions(state, change, interactions, ri, species, time_increment):
+    remaining = time_increment
+    new_state = state+change
+    while np.any(new_state <= 0):
+        extinct = new_state <= 0
+        fractions = np.full(len(state), np.inf)
+        fractions[extinct] = state[extinct]/(state[extinct]-new_state[extinct])
+        first = np.argmin(fractions)
+        crossing = fractions[first]*remaining
+        partial = kernel_RK_step(state, interactions, ri, crossing)
+        if not np.all(np.isfinite(partial)):
+            return new_state, interactions, ri, species, False
+        state = state+partial
+        surviving = state > 0
+        surviving[first] = False
+        surviving = np.nonzero(surviving)[0]
+        interactions, ri = kernel_compact_community(interactions, ri, surviving)
+        species = species[surviving]
+        state = state[surviving]
+        remaining -= crossing
+        change = kernel_RK_step(state, interactions, ri, remaining)
+        if not np.all(np.isfinite(change)):
+            return new_state, interactions, ri, species, False
+        new_state = state+change
+    return new_state, interactions, ri, species, True
+
+@jit
+def kernel_polish_steady_state(state, interactions, ri, polish_tolerance):
+    if len(state) == 0:
+        return state
+    try:
+        polished = np.linalg.solve(interactions, -ri)
+    except Exception:
+        return state
+    if np.all(polished > 0) and np.max(np.abs(polished-state)) <= polish_tolerance*np.max(state):
+        return polished
+    return state
+
+@jit
+def gLV_RK_kernel(abundances, interactions, ri, time_increment, steady_rtol, steady_atol, steady_window, polish, steady_growth_tol):
+    max_increments = abundances.shape[0]-1
+    species = np.nonzero(abundances[0] != 0)[0]
+    active_interactions, active_ri = kernel_compact_community(interactions, ri, species)
+    state = abundances[0][species]
+    calm = 0
+    time = 1
+    while time < max_increments+1:
+        change = kernel_RK_step(state, active_interactions, active_ri, time_increment)
+        if not np.all(np.isfinite(change)):
+            return -1
+        state, active_interactions, active_ri, species, ok = kernel_locate_extinctions(state, change, active_interactions, active_ri, species, time_increment)
+        if not ok:
+            return -1
+        largest_change = np.max(np.abs(change)) if len(change) > 0 else 0.0
+        largest_abundance = np.max(np.abs(state)) if len(state) > 0 else 0.0
+        calm_step = largest_change <= steady_atol+steady_rtol*largest_abundance
+        if calm_step and len(state) > 0:
+            largest_growth = np.max(np.abs(active_ri+active_interactions@state))
+            calm_step = largest_growth*time_increment <= steady_growth_tol
+        if calm_step:
+            calm += 1
+        else:
+            calm = 0
+        if calm >= steady_window:
+            if polish:
+                state = kernel_polish_steady_state(state, active_interactions, active_ri, 1e-3)
+            for tail in range(time, max_increments+1):
+                abundances[tail][species] = state
+            return 1
+        abundances[time][species] = state
+        time += 1
+    return 0
+
+@jit
+def stochastic_gLV_RK_kernel(abundances, interactions, ri, time_increment, sigma, noise, start):
+    species = np.nonzero(abundances[start-1] != 0)[0]
+    active_interactions, active_ri = kernel_compact_community(interactions, ri, species)
+    state = abundances[start-1][species]
+    time = start
+    while time < start+noise.shape[0]:
+        change = kernel_RK_step(state, active_interactions, active_ri, time_increment)
+        if not np.all(np.isfinite(change)):
+            return -1
+        dW = noise[time-start][species]
+        state = state+change+np.sqrt(state*sigma[species])*dW
+        if not np.all(np.isfinite(state)):
+            return -1
+        surviving = np.nonzero(state > 0)[0]
+        if len(surviving) < len(species):
+            active_interactions, active_ri = kernel_compact_community(active_interactions, active_ri, surviving)
+            species = species[surviving]
+            state = state[surviving]
+        abundances[time][species] = state
+        time += 1
+    return 0
+
+def numba_gLV_RK(n, maxtime, time_increment, interactions, ri, starting_abundances, steady_rtol=1e-9, steady_atol=1e-6, steady_window=10, polish=False, steady_growth_tol=1e-6):
+    if not numba_available or issparse(interactions):
+        return gLV_RK(n, maxtime, time_increment, interactions, ri, starting_abundances, None, steady_rtol, steady_atol, steady_window, polish, steady_growth_tol)
+    max_increments = int(maxtime*(1/time_increment))
+    abundances = np.zeros((max_increments+1, n))
+    abundances[0] = starting_abundances
+    status = gLV_RK_kernel(abundances, np.ascontiguousarray(interactions, dtype=float), np.asarray(ri, dtype=float), float(time_increment), float(steady_rtol), float(steady_atol), int(steady_window), bool(polish), float(steady_growth_tol))
+    if status == -1:
+        return -1
+    return abundances
+
+def numba_stochastic_gLV_RK(n, maxtime, time_increment, interactions, ri, starting_abundances, sigma, rng=None, noise='wiener', block_size=1000):
+    if not numba_available or issparse(interactions):
+        return stochastic_gLV_RK(n, maxtime, time_increment, interactions, ri, starting_abundances, sigma, rng, noise, block_size)
+    max_increments = int(maxtime*(1/time_increment))
+    abundances = np.zeros((max_increments+1, n))
+    abundances[0] = starting_abundances
+    interactions = np.ascontiguousarray(interactions, dtype=float)
+    ri = np.asarray(ri, dtype=float)
+    sigma = np.asarray(sigma, dtype=float)
+    start = 1
+    for block in noise_blocks(find_rng(rng), noise, n, max_increments, time_increment, block_size):
+        status = stochastic_gLV_RK_kernel(abundances, interactions, ri, float(time_increment), sigma, block, start)
+        if status == -1:
+            return -1
+        start += len(block)
+    return abundances
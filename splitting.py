@@ -0,0 +1,108 @@
+import numpy as np
+from sim_gLV_RK import find_rng
+
+''' Rare event estimation of establishment probabilities with fixed effort multilevel splitting.
+
+A mutant far below its establishment threshold almost always goes extinct, so plain Monte Carlo
+needs of the order of 1/p replicates to see a single establishment. Multilevel splitting uses the
+abundance of the mutant as importance function: the interval between the invasion abundance and
+the establishment abundance is divided by increasing levels L_1 < L_2 < ... < L_m (L_m being the
+establishment abundance). The mutant has to reach every level before it can end above L_m, so
+the probability of establishment is the product of the conditional probabilities of reaching the
+next level before the mutant goes extinct or the simulation ends, given that the previous level
+was reached, times the probability that the mutant is still at or above the establishment
+abundance when the simulation ends, given that L_m was reached. At each stage effort trajectories
+are started from states sampled (with replacement) from the entrance states of the trajectories
+that reached the previous level, so the successful trajectories are cloned and every stage only
+has to estimate a probability that isn't small.
+
+The dynamics and the event are the same as in invasion.establishment_trial, so the estimates can
+be compared with invasion.establishment_probability: the model is the one of
+simulations_simple_gLV.stochastic_simple_gLV_with_extinction (Euler step plus the noise term
+sqrt(N_i*sigma_i)*dW with dW the difference of two uniform random numbers, abundances rounded to
+6 decimals, species with abundance <= 0 are extinct for good) and the simulation ends at maxtime
+or at the first step where the per capita change of every living species is at most 0.0001 (the
+steady state check of that function), and the mutant is established if its abundance at the end is
+at least establishment_abundance. All trajectories of a stage are advanced together. Trajectories
+that become non-finite are errors, which stochastic_simple_gLV_with_extinction returns as "-2",
+and like those trials in establishment_probability they are left out of the stage counts.
+
+splitting_levels: Returns number_of_levels levels spaced geometrically from above the invasion
+abundance up to the establishment abundance (which is the last level).
+
+simple_gLV_step: One step of stochastic_simple_gLV_with_extinction for a batch of states. Returns
+the new states and a mask of the states that passed the steady state check in this step.
+
+advance_to_level: Advances a batch of states, each with its own time step count, until the mutant
+reaches the level (success), goes extinct or the simulation ends (failure). Trajectories that end
+are given max_increments steps, so they stay ended when they are cloned. Returns the states when
+they stopped, their step counts, the success mask and the error mask.
+
+establishment_splitting: Fixed effort multilevel splitting estimate of the probability that the
+mutant (1-based, as in invasion.py) has at least establishment_abundance at the end of the
+simulation, starting from starting_abundances. Returns the probability, the conditional
+probabilities of the stages (the levels, then the final check) and an estimate of the relative error
+(standard deviation/probability) assuming independent stages. If no trajectory gets through a
+stage the probability is 0 and the remaining stages are NaN.
+'''
+
+def splitting_levels(invasion_abundance, establishment_abundance, number_of_levels):
+    return np.geomspace(invasion_abundance, establishment_abundance, number_of_levels+1)[1:]
+
+def simple_gLV_step(states, interactions, ri, sigma, time_increment, rng):
+    change_per_capita = (ri+states@interactions.T)*time_increment
+    steady = np.all((np.abs(change_per_capita) <= 0.0001) | (states <= 0), axis=1)
+    dW = rng.random(states.shape)-rng.random(states.shape)
+    states = np.around(states+states*change_per_capita+np.sqrt(states*sigma)*dW, decimals=6)
+    states[~(states > 0)] = 0
+    return states, steady
+
+def advance_to_level(states, increments, max_increments, time_increment, interactions, ri, sigma, mutant, level, rng):
+    states = states.copy()
+    increments = increments.copy()
+    success = np.zeros(len(states), dtype=bool)
+    error = np.zeros(len(states), dtype=bool)
+    running = (states[:, mutant] > 0) & (states[:, mutant] < level) & (increments < max_increments)
+    success[~running] = states[~running, mutant] >= level
+    while np.any(running):
+        active = np.flatnonzero(running)
+        with np.errstate(all='ignore'):
+            state, steady = simple_gLV_step(states[active], interactions, ri, sigma, time_increment, rng)
+        finite = np.all(np.isfinite(state), axis=1)
+        states[active] = state
+        increments[active] = np.where(steady, max_increments, increments[active]+1)
+        error[active[~finite]] = True
+        reached = finite & (state[:, mutant] >= level)
+        success[active[reached]] = True
+        running[active] = finite & ~reached & (state[:, mutant] > 0) & (increments[active] < max_increments)
+    return states, increments, success, error
+
+def establishment_splitting(n, maxtime, time_increment, interactions, ri, starting_abundances, sigma, mutant, establishment_abundance, levels=None, number_of_levels=10, effort=1000, rng=None):
+    rng = find_rng(rng)
+    mutant = mutant - 1
+    max_increments = int(maxtime*(1/time_increment))
+    sigma = np.asarray(sigma, dtype=float)
+    ri = np.asarray(ri, dtype=float)
+    interactions = np.asarray(interactions, dtype=float)
+    if levels is None:
+        levels = splitting_levels(starting_abundances[mutant], establishment_abundance, number_of_levels)
+    # The last stage runs the trajectories to the end and checks the mutant against establishment_abundance
+    stage_levels = np.append(levels, np.inf)
+    level_probabilities = np.full(len(stage_levels), np.nan)
+    entrance_states = np.array([starting_abundances], dtype=float)
+    entrance_increments = np.zeros(1, dtype=int)
+    for k, level in enumerate(stage_levels):
+        starts = rng.integers(0, len(entrance_states), effort)
+        states, increments, success, error = advance_to_level(entrance_states[starts], entrance_increments[starts], max_increments, time_increment, interactions, ri, sigma, mutant, level, rng)
+        if k == len(levels):
+            success = ~error & (states[:, mutant] >= establishment_abundance)
+        if np.all(error):
+            return np.nan, level_probabilities, np.nan
+        level_probabilities[k] = np.sum(success)/np.sum(~error)
+        if not np.any(success):
+            return 0.0, level_probabilities, np.inf
+        entrance_states = states[success]
+        entrance_increments = increments[success]
+    probability = np.prod(level_probabilities)
+    relative_error = np.sqrt(np.sum((1-level_probabilities)/(level_probabilities*effort)))
+    return probability, level_probabilities, relative_error
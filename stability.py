@@ -0,0 +1,96 @@
+import numpy as np
+import warnings
+from scipy.linalg import LinAlgWarning
+from scipy.sparse import issparse, diags, csr_matrix
+from scipy.sparse.linalg import eigs, ArpackNoConvergence
+from GLV_steady_state_calculator import steady_state_glv, loo_steady_state_glv
+
+''' Local stability analysis of generalized Lotka-Volterra steady states without time integration.
+
+At a steady state N* where all species are present the Jacobian of the gLV model is the community
+matrix diag(N*)A, and the steady state is locally stable when all its eigenvalues have negative
+real parts, so the leading eigenvalue (the largest real part) decides stability.
+
+community_matrix: Returns diag(N*)A for the given abundances, sparse if the interactions are sparse.
+
+leading_eigenvalue: Largest real part of the eigenvalues of a matrix. Sparse matrices larger than
+arnoldi_size are handled with the Arnoldi method (scipy.sparse.linalg.eigs, eigenvalue with the
+largest real part), all others with a dense eigenvalue solver. Returns NaN for an empty matrix.
+
+batch_leading_eigenvalues: Leading eigenvalues of a (B, m, m) stack of dense matrices with one
+batched call of numpy.linalg.eigvals.
+
+steady_state_stability: Steady state of the full community from steady_state_glv, a flag that it
+is feasible (all abundances positive) and the leading eigenvalue of its community matrix. If the
+interactions matrix is singular the abundances and the eigenvalue are NaN and it isn't feasible.
+
+loo_stability: The same for all n leave-one-out communities, from loo_steady_state_glv. For dense
+interactions the community matrices are built with index arrays and their eigenvalues are found
+in batches of chunk_size communities, so memory stays at chunk_size*(n-1)^2 values. Sparse
+interactions are handled one community at a time with leading_eigenvalue. Communities without a
+unique steady state (NaN abundances from loo_steady_state_glv) aren't feasible and their leading
+eigenvalue is NaN. With feasible_only=True the eigenvalues are only found for the feasible
+communities (NaN for the others), for callers that only need the stable and feasible ones.
+
+stable_communities: Boolean mask of the communities (full community first, then leave-one-out
+communities) that are feasible and have a leading eigenvalue below -tolerance.
+'''
+
+def community_matrix(abundances, interactions):
+    if issparse(interactions):
+        return csr_matrix(diags(abundances)@interactions)
+    return abundances[:, None]*interactions
+
+def leading_eigenvalue(matrix, arnoldi_size=500):
+    if matrix.shape[0] == 0:
+        return np.nan
+    if issparse(matrix):
+        if matrix.shape[0] > arnoldi_size:
+            try:
+                return np.max(np.real(eigs(matrix, k=1, which='LR', return_eigenvectors=False)))
+            except ArpackNoConvergence:
+                pass
+        matrix = matrix.toarray()
+    return np.max(np.real(np.linalg.eigvals(matrix)))
+
+def batch_leading_eigenvalues(matrices):
+    return np.max(np.real(np.linalg.eigvals(matrices)), axis=-1)
+
+def steady_state_stability(n, ri, interactions_matrix, arnoldi_size=500):
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', LinAlgWarning)
+            abundances = steady_state_glv(n, ri, interactions_matrix)
+    except (np.linalg.LinAlgError, LinAlgWarning):
+        return np.full(n, np.nan), False, np.nan
+    feasible = bool(np.all(abundances > 0))
+    return abundances, feasible, leading_eigenvalue(community_matrix(abundances, interactions_matrix), arnoldi_size)
+
+def loo_stability(n, ri, interactions_matrix, chunk_size=64, arnoldi_size=500, feasible_only=False):
+    loo_abundances = loo_steady_state_glv(n, ri, interactions_matrix)
+    keep = np.array([np.delete(np.arange(n), i) for i in range(n)])
+    residents = np.take_along_axis(loo_abundances, keep, axis=1)
+    feasible = np.all(residents > 0, axis=1)
+    # Cultures without a unique steady state (NaN abundances) have no community matrix
+    computed = np.all(np.isfinite(residents), axis=1)
+    if feasible_only:
+        computed &= feasible
+    targets = np.flatnonzero(computed)
+    eigenvalues = np.full(n, np.nan)
+    if issparse(interactions_matrix):
+        interactions_matrix = interactions_matrix.tocsr()
+        for i in targets:
+            reduced = interactions_matrix[keep[i]][:, keep[i]]
+            eigenvalues[i] = leading_eigenvalue(community_matrix(residents[i], reduced), arnoldi_size)
+        return loo_abundances, feasible, eigenvalues
+    for start in range(0, len(targets), chunk_size):
+        chunk = targets[start:start+chunk_size]
+        rows = keep[chunk]
+        reduced = interactions_matrix[rows[:, :, None], rows[:, None, :]]
+        eigenvalues[chunk] = batch_leading_eigenvalues(residents[chunk, :, None]*reduced)
+    return loo_abundances, feasible, eigenvalues
+
+def stable_communities(n, ri, interactions_matrix, tolerance=0, chunk_size=64, arnoldi_size=500):
+    abundances, feasible, eigenvalue = steady_state_stability(n, ri, interactions_matrix, arnoldi_size)
+    loo_abundances, loo_feasible, loo_eigenvalues = loo_stability(n, ri, interactions_matrix, chunk_size, arnoldi_size, feasible_only=True)
+    return np.concatenate(([feasible and eigenvalue < -tolerance], loo_feasible & (loo_eigenvalues < -tolerance)))